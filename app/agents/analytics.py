@@ -1,20 +1,174 @@
+import asyncio
+import hashlib
 import logging
 import os
 import json
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
+import re
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+import pandas as pd
+from google.analytics.data_v1beta import BetaAnalyticsDataAsyncClient
+from google.api_core import exceptions as google_exceptions
+from google.api_core.retry_async import AsyncRetry, if_exception_type
+from google.oauth2 import service_account
 from google.analytics.data_v1beta.types import (
     RunReportRequest,
     DateRange,
     Metric,
     Dimension,
     FilterExpression,
-    OrderBy
+    OrderBy,
+    MetricAggregation,
+    RunReportResponse,
+    BatchRunReportsRequest
 )
-from app.llm.client import llm_client
-from app.llm.schemas import GA4QueryPlan, AnalysisSummary
+from app.llm.client import llm_client, PRIORITY_LOW
+from app.llm.schemas import GA4QueryPlan, GA4ReportPlans, AnalysisSummary
+from app.models import AgentResult
+from app.singleflight import SingleFlight
+from app.ga4_quota import GA4QuotaScheduler, QuotaExhausted
+from app.plan_cache import plan_cache, ga4_key
+from app.ga4_digest import GA4_DIGEST_FULL_ROWS, DATE_RANGE_DIMENSION, asks_for_analysis, build_digest, render_template_answer
+from app import metrics, request_context
 
 logger = logging.getLogger(__name__)
 
+CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "credentials.json")
+GA4_SCOPES = ["https://www.googleapis.com/auth/analytics.readonly"]
+
+# Per-attempt timeout and retry policy for GA4 Data API calls
+GA4_TIMEOUT_SECONDS = float(os.getenv("GA4_TIMEOUT_SECONDS", "30"))
+GA4_RETRY_INITIAL_SECONDS = float(os.getenv("GA4_RETRY_INITIAL_SECONDS", "1"))
+GA4_RETRY_MAX_SECONDS = float(os.getenv("GA4_RETRY_MAX_SECONDS", "10"))
+GA4_RETRY_TIMEOUT_SECONDS = float(os.getenv("GA4_RETRY_TIMEOUT_SECONDS", "60"))
+
+# Relative dates are resolved in the property's timezone ("id=Area/City,..." overrides the default)
+GA4_PROPERTY_TIMEZONE = os.getenv("GA4_PROPERTY_TIMEZONE", "UTC")
+GA4_PROPERTY_TIMEZONES = dict(
+    item.split("=", 1) for item in os.getenv("GA4_PROPERTY_TIMEZONES", "").split(",") if "=" in item
+)
+
+# Report cache: closed historical ranges live long, ranges still receiving data briefly
+GA4_REPORT_CACHE_ENABLED = os.getenv("GA4_REPORT_CACHE_ENABLED", "true").lower() == "true"
+GA4_REPORT_CACHE_MAX_BYTES = int(os.getenv("GA4_REPORT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+GA4_REPORT_CACHE_HISTORICAL_TTL_SECONDS = float(os.getenv("GA4_REPORT_CACHE_HISTORICAL_TTL_SECONDS", "86400"))
+GA4_REPORT_CACHE_RECENT_TTL_SECONDS = float(os.getenv("GA4_REPORT_CACHE_RECENT_TTL_SECONDS", "300"))
+# Days before today that GA4 may still be processing; ranges ending inside this window count as recent
+GA4_REPORT_CACHE_SETTLE_DAYS = int(os.getenv("GA4_REPORT_CACHE_SETTLE_DAYS", "1"))
+
+# Reports for the same property pending within the window are sent as one batch_run_reports call
+GA4_BATCH_ENABLED = os.getenv("GA4_BATCH_ENABLED", "true").lower() == "true"
+GA4_BATCH_WINDOW_SECONDS = float(os.getenv("GA4_BATCH_WINDOW_SECONDS", "0.005"))
+GA4_BATCH_MAX_REPORTS = 5  # API limit per batchRunReports call
+
+# Rows fetched per report (pages of GA4_PAGE_SIZE via limit/offset); the summarizer sees a digest
+GA4_ROW_BUDGET = int(os.getenv("GA4_ROW_BUDGET", "10000"))
+GA4_PAGE_SIZE = int(os.getenv("GA4_PAGE_SIZE", "10000"))
+
+# Answer simple report shapes (single number, top-N, short date series) without the summary LLM call
+GA4_TEMPLATE_ANSWERS_ENABLED = os.getenv("GA4_TEMPLATE_ANSWERS_ENABLED", "true").lower() == "true"
+
+_DAYS_AGO_RE = re.compile(r"^(\d+)daysAgo$")
+
+
+def property_today(property_id: str) -> date:
+    """Today's date in the property's reporting timezone."""
+    zone = GA4_PROPERTY_TIMEZONES.get(str(property_id), GA4_PROPERTY_TIMEZONE)
+    return datetime.now(ZoneInfo(zone)).date()
+
+
+def resolve_date(value: str, today: date) -> str:
+    """Resolve GA4 relative dates ("today", "yesterday", "NdaysAgo") to YYYY-MM-DD."""
+    value = value.strip()
+    if value == "today":
+        return today.isoformat()
+    if value == "yesterday":
+        return (today - timedelta(days=1)).isoformat()
+    match = _DAYS_AGO_RE.match(value)
+    if match:
+        return (today - timedelta(days=int(match.group(1)))).isoformat()
+    return value
+
+
+class GA4ReportCache:
+    """LRU cache of RunReportResponse objects bounded by serialized size, with per-entry TTL."""
+
+    def __init__(
+        self,
+        max_bytes: int = GA4_REPORT_CACHE_MAX_BYTES,
+        historical_ttl: float = GA4_REPORT_CACHE_HISTORICAL_TTL_SECONDS,
+        recent_ttl: float = GA4_REPORT_CACHE_RECENT_TTL_SECONDS,
+        settle_days: int = GA4_REPORT_CACHE_SETTLE_DAYS,
+    ):
+        self.max_bytes = max_bytes
+        self.historical_ttl = historical_ttl
+        self.recent_ttl = recent_ttl
+        self.settle_days = settle_days
+
+        self._entries = OrderedDict()  # key -> (expires_at, response, size in bytes)
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[RunReportResponse]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, response, _ = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.GA4_REPORT_CACHE_REQUESTS.labels(result="hit").inc()
+                return response
+            self._remove(key)
+        self.misses += 1
+        metrics.GA4_REPORT_CACHE_REQUESTS.labels(result="miss").inc()
+        return None
+
+    def set(self, key: str, request: RunReportRequest, response: RunReportResponse, today: date):
+        ttl = self.ttl_for(request, today)
+        size = RunReportResponse.pb(response).ByteSize()
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time() + ttl, response, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        metrics.GA4_REPORT_CACHE_BYTES.set(self._bytes)
+
+    def ttl_for(self, request: RunReportRequest, today: date) -> float:
+        """Long TTL when every range ended before the settling window, short otherwise."""
+        cutoff = today - timedelta(days=self.settle_days)
+        for date_range in request.date_ranges:
+            try:
+                end = date.fromisoformat(resolve_date(date_range.end_date, today))
+            except ValueError:
+                return self.recent_ttl
+            if end >= cutoff:
+                return self.recent_ttl
+        return self.historical_ttl
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        metrics.GA4_REPORT_CACHE_BYTES.set(self._bytes)
+
 # GA4 Allowlist - Safe metrics and dimensions
 # Reference: https://developers.google.com/analytics/devguides/reporting/data/v1/api-schema
 ALLOWED_METRICS = {
@@ -51,43 +205,386 @@ ALLOWED_DIMENSIONS = {
     "itemName", "itemId", "itemCategory", "itemBrand",
 }
 
+# GA4QueryPlan field guide, shared with the orchestrator's unified planner prompt
+GA4_PLAN_GUIDE = """- metrics: List of metric names (e.g., "activeUsers", "screenPageViews", "sessions")
+- dimensions: List of dimension names (e.g., "date", "pagePath", "country")
+- date_ranges: List of date ranges with start_date and end_date (YYYY-MM-DD or relative like "7daysAgo", "yesterday")
+- order_by: Optional list of ordering with field name and desc (true/false)
+- limit: Optional maximum number of rows for "top N" questions (e.g. 5 for "top 5 pages")
+
+IMPORTANT: Use standard GA4 API metric and dimension names:
+- For users: activeUsers, newUsers, totalUsers
+- For views: screenPageViews
+- For sessions: sessions, engagedSessions
+- For pages: pagePath, pageTitle
+- For traffic: sessionSource, sessionMedium
+
+Use a single plan unless the question needs separate breakdowns (e.g. "by device and by country" is two plans).
+Compare periods with several date_ranges in one plan (at most 4) rather than separate plans."""
+
 
 class AnalyticsAgent:
     def __init__(self):
-        # Set credentials env var for Google Client
-        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "credentials.json"
-        
+        # Identical concurrent reports share one run_report call
+        self._inflight = SingleFlight("ga4")
+        # Per-property quota tracking and admission (interactive before batch)
+        self.quota = GA4QuotaScheduler()
+        # Reports waiting to be sent, per property: [(request, future, budget)]
+        self._pending = {}
+        self._flush_timers = {}
+        self._batch_tasks = set()
+        # Completed reports are reused across requests
+        self.report_cache = GA4ReportCache() if GA4_REPORT_CACHE_ENABLED else None
+        # One long-lived client (gRPC channel + credentials) shared by all requests
+        self._client = None
+        # Transient server errors are retried; bad requests and quota errors are not
+        self._retry = AsyncRetry(
+            predicate=if_exception_type(
+                google_exceptions.ServiceUnavailable,
+                google_exceptions.InternalServerError,
+                google_exceptions.DeadlineExceeded,
+            ),
+            initial=GA4_RETRY_INITIAL_SECONDS,
+            maximum=GA4_RETRY_MAX_SECONDS,
+            timeout=GA4_RETRY_TIMEOUT_SECONDS,
+        )
+
+    async def start(self):
+        """Create the shared GA4 client; called once at application startup."""
+        try:
+            self._get_client()
+        except Exception as e:
+            # Analytics queries report the error; SEO queries keep working
+            logger.error(f"Could not create GA4 client: {e}")
+
+    async def aclose(self):
+        """Close the shared client's channel."""
+        client, self._client = self._client, None
+        if client is not None:
+            await client.transport.close()
+
     def _get_client(self):
-         return BetaAnalyticsDataClient()
+        """
+        The shared async client, created on first use.
 
-    async def process_query(self, query: str, property_id: str):
-        # 1. Infer GA4 parameters using LLM
-        plan = self._infer_plan_with_llm(query)
-        if not plan:
-            return "I could not understand how to query GA4 for that request."
-        
-        logger.debug(f"Raw GA4 Plan: {plan}")
+        Credentials are read once from the service account file and refreshed
+        by the auth library as tokens expire; without the file, application
+        default credentials are used.
+        """
+        if self._client is None:
+            credentials = None
+            if os.path.exists(CREDENTIALS_FILE):
+                credentials = service_account.Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=GA4_SCOPES)
+            self._client = BetaAnalyticsDataAsyncClient(credentials=credentials)
+        return self._client
+
+    async def process_query(self, query: str, property_id: str, plans: List[GA4QueryPlan] = None, prefetch=None):
+        result = await self.run_query(query, property_id, plans=plans, prefetch=prefetch)
+        return result.text
+
+    async def run_query(
+        self, query: str, property_id: str, summarize: bool = True, plans: List[GA4QueryPlan] = None, prefetch=None
+    ) -> AgentResult:
+        """
+        Answer a query, returning the report rows as a DataFrame alongside the text.
+
+        A question may need several reports (one plan each); they run
+        concurrently and are folded into batch_run_reports calls, and their
+        rows are combined with a "report" column. Each report is fetched up to
+        GA4_ROW_BUDGET rows and the summarizer gets a fixed-size digest of it.
+        With summarize=False the LLM summary is skipped and the text is a plain
+        rendering of the rows (used when the orchestrator fuses results
+        itself). Plans precomputed by the orchestrator's planner skip the
+        planning call, and a prefetch (awaitable from speculate()) supplies
+        the validated plans and possibly the reports themselves. Planner plans
+        take precedence: speculative reports are only used if they were
+        fetched for the same plans.
+        """
+        frames = None
+        validated_plans = None
+        if plans:
+            logger.debug(f"Raw GA4 Plans: {plans}")
+            validated_plans = self._validate_plans(plans)
+        if prefetch is not None:
+            try:
+                speculated_plans, speculated_frames = await prefetch
+                if validated_plans is None:
+                    validated_plans, frames = speculated_plans, speculated_frames
+                elif speculated_plans == validated_plans:
+                    frames = speculated_frames
+            except Exception as e:
+                logger.warning(f"Speculative GA4 work failed, planning normally: {e}")
+
+        # 1-2. Infer GA4 parameters using LLM (unless already planned or memoized) and
+        # validate them against the allowlist (plans left without metrics are dropped)
+        if validated_plans is None:
+            validated_plans = await self._plans_for(query)
+        if validated_plans is None:
+            request_context.mark_degraded("ga4: no plan")
+            return AgentResult(text="I could not understand how to query GA4 for that request.")
         
-        # 2. Validate plan against allowlist
-        validated_plan = self._validate_plan(plan)
-        if not validated_plan.get('metrics'):
-            return "None of the inferred metrics are valid for GA4. Please try rephrasing your query."
-            
-        logger.debug(f"Validated GA4 Plan: {validated_plan}")
+        if frames is None:
+            if not validated_plans:
+                request_context.mark_degraded("ga4: no valid metrics")
+                return AgentResult(text="None of the inferred metrics are valid for GA4. Please try rephrasing your query.")
+                
+            logger.debug(f"Validated GA4 Plans: {validated_plans}")
 
-        # 3. Construct Request
-        request = self._build_request(property_id, validated_plan)
+            # 3. Construct Requests
+            requests = [self._build_request(property_id, v) for v in validated_plans]
 
-        # 4. Execute Request
+            # 4. Execute Requests
+            try:
+                frames = await asyncio.gather(*(
+                    self._fetch_report(r, max_rows=v.get('limit')) for r, v in zip(requests, validated_plans)
+                ))
+            except QuotaExhausted as e:
+                request_context.mark_degraded("ga4: quota exhausted")
+                return AgentResult(text=str(e))
+            except Exception as e:
+                request_context.mark_degraded("ga4: report error")
+                return AgentResult(text=f"Error executing GA4 query: {str(e)}")
+
+        for report in frames:
+            request_context.emit("ga4_rows", self._rows_event(report))
+        frame = frames[0] if len(frames) == 1 else pd.concat(
+            [f.assign(report=i + 1)[["report", *f.columns]] for i, f in enumerate(frames)], ignore_index=True
+        )
+
+        # 5. Summarize results
+        if not summarize:
+            return AgentResult(text=self._frames_text(frames), frame=frame)
+        answer = self._template_answer(query, validated_plans, frames)
+        if answer is not None:
+            metrics.GA4_ANSWERS.labels(source="template").inc()
+            if request_context.stream_tokens():
+                request_context.emit("token", {"text": answer})
+            return AgentResult(text=answer, frame=frame)
+        metrics.GA4_ANSWERS.labels(source="llm").inc()
         try:
-            client = self._get_client()
-            response = client.run_report(request)
+            summary = await self._summarize_response(query, frames)
+        except request_context.DeadlineExceeded:
+            request_context.mark_degraded("ga4: summary skipped at deadline")
+            summary = f"GA4 report (not summarized, the request deadline was reached):\n{self._frames_text(frames)}"
+        return AgentResult(text=summary, frame=frame)
+
+    def _template_answer(self, query: str, validated_plans: List[dict], frames: List[pd.DataFrame]) -> Optional[str]:
+        """Local answer when the question is one report of a shape render_template_answer knows and asks for nothing more."""
+        if not GA4_TEMPLATE_ANSWERS_ENABLED or len(validated_plans) != 1 or len(frames) != 1:
+            return None
+        if asks_for_analysis(query):
+            return None
+        return render_template_answer(frames[0], validated_plans[0])
+
+    async def _plans_for(self, query: str, calls: list = None) -> Optional[List[dict]]:
+        """
+        Validated plans for a question, memoized by normalized query text.
+
+        None when planning failed; an empty list when no plan had valid
+        metrics. Only usable plans are memoized. "plan" is appended to calls
+        when the LLM had to be asked.
+        """
+        key = ga4_key(query)
+        validated_plans = plan_cache.get(key)
+        if validated_plans is not None:
+            return validated_plans
+        if calls is not None:
+            calls.append("plan")
+        plans = await self._infer_plans_with_llm(query)
+        if not plans:
+            return None
+        logger.debug(f"Raw GA4 Plans: {plans}")
+        validated_plans = self._validate_plans(plans)
+        if validated_plans:
+            plan_cache.set(key, validated_plans)
+        return validated_plans
+
+    async def warm_plans(self, entries: list):
+        """Pin the given plans ({"query", "plans"}) or plan the listed questions ({"query"}) into the plan cache."""
+        # Pinned entries first, so they apply before any LLM call is awaited
+        for entry in sorted(entries, key=lambda e: not e.get("plans")):
+            try:
+                if entry.get("plans"):
+                    plans = [GA4QueryPlan.model_validate(p) for p in entry["plans"]]
+                    validated_plans = self._validate_plans(plans)
+                    plan_cache.set(ga4_key(entry["query"]), validated_plans, pinned=True)
+                else:
+                    await self._plans_for(entry["query"])
+            except Exception as e:
+                logger.error(f"Could not warm GA4 plan for {entry!r}: {e}")
+
+    def _validate_plans(self, plans: List[GA4QueryPlan]) -> List[dict]:
+        """Validate plans against the allowlist, dropping plans left without metrics."""
+        return [v for v in (self._validate_plan(p) for p in plans) if v.get('metrics')]
+
+    async def speculate(self, query: str, property_id: str, run_report: bool = False, calls: list = None):
+        """
+        Plan (and optionally execute) reports before routing has decided GA4 is needed.
+
+        Returns (validated plans, frames) for run_query(prefetch=...); frames
+        is None unless run_report is set and a plan validated. The names of
+        calls started ("plan", "report") are appended to calls so the caller
+        can account for wasted work when the speculation is discarded.
+        """
+        calls = calls if calls is not None else []
+        validated_plans = await self._plans_for(query, calls)
+        frames = None
+        if validated_plans and run_report:
+            calls.extend("report" for _ in validated_plans)
+            try:
+                frames = await asyncio.gather(
+                    *(self._fetch_report(self._build_request(property_id, v), max_rows=v.get('limit'))
+                      for v in validated_plans)
+                )
+            except Exception as e:
+                logger.warning(f"Speculative GA4 report failed: {e}")
+        return validated_plans, frames
+
+    async def _fetch_report(self, request: RunReportRequest, max_rows: int = None) -> pd.DataFrame:
+        """
+        Fetch a report's rows up to GA4_ROW_BUDGET (or max_rows) as one frame.
+
+        The first page tells how many rows matched; the remaining pages are
+        requested together with limit/offset (so they share a batch call).
+        frame.attrs carries row_count, totals, the dimension/metric names and
+        the resolved date ranges.
+        """
+        first = await self._run_report(request)
+        target = min(first.row_count, GA4_ROW_BUDGET, max_rows or GA4_ROW_BUDGET)
+        page_size = max(request.limit or GA4_PAGE_SIZE, 1)
+        offsets = range(len(first.rows), target, page_size) if first.rows else range(0)
+        pages = await asyncio.gather(*(
+            self._run_report(self._page_request(request, offset, min(page_size, target - offset))) for offset in offsets
+        ))
+        frame = self._response_frame([first, *pages])
+        frame.attrs["date_ranges"] = [(d.start_date, d.end_date) for d in request.date_ranges]
+        return frame
+
+    def _page_request(self, request: RunReportRequest, offset: int, limit: int) -> RunReportRequest:
+        page = RunReportRequest.deserialize(RunReportRequest.serialize(request))
+        page.offset, page.limit = offset, limit
+        return page
+
+    async def _run_report(self, request: RunReportRequest):
+        """Execute a report, served from the report cache or coalesced with an identical call in flight."""
+        key = self._request_key(request)
+        if self.report_cache is not None:
+            cached = self.report_cache.get(key)
+            if cached is not None:
+                return cached
+
+        async def run(budget: request_context.Budget):
+            property_id = request.property.split("/")[-1]
+            if GA4_BATCH_ENABLED:
+                response = await self._submit(property_id, request, budget)
+            else:
+                timeout, retry_timeout = self._call_timeouts(budget)
+                response = (await self._send(property_id, [request], timeout, retry_timeout, budget.traffic))[0]
+            if self.report_cache is not None:
+                self.report_cache.set(key, request, response, property_today(property_id))
+            return response
+
+        return await request_context.within_deadline(self._inflight.do(key, run))
+
+    def _call_timeouts(self, budget: request_context.Budget):
+        """Per-attempt and total retry timeouts, capped by the remaining budget of the call's waiters."""
+        timeout, retry_timeout = GA4_TIMEOUT_SECONDS, GA4_RETRY_TIMEOUT_SECONDS
+        left = budget.remaining()
+        if left is not None:
+            timeout, retry_timeout = min(timeout, max(left, 0.001)), min(retry_timeout, max(left, 0.001))
+        return timeout, retry_timeout
+
+    async def _submit(self, property_id: str, request: RunReportRequest, budget: request_context.Budget):
+        """Queue a report to be sent with other reports for the property pending within the batch window."""
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(property_id, [])
+        # The budget is read at flush time, so callers joining meanwhile still widen it
+        pending.append((request, future, budget))
+        if len(pending) >= GA4_BATCH_MAX_REPORTS:
+            self._flush(property_id)
+        elif len(pending) == 1:
+            self._flush_timers[property_id] = asyncio.get_running_loop().call_later(
+                GA4_BATCH_WINDOW_SECONDS, self._flush, property_id
+            )
+        return await future
+
+    def _flush(self, property_id: str):
+        timer = self._flush_timers.pop(property_id, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._pending.pop(property_id, [])
+        if items:
+            task = asyncio.ensure_future(self._send_pending(property_id, items))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_pending(self, property_id: str, items: list):
+        """Send flushed reports in one call and hand each waiter its own response."""
+        items = [item for item in items if not item[1].done()]  # Waiters cancelled meanwhile
+        if not items:
+            return
+        # The call serves every waiter: use the most generous budget and the most urgent traffic class
+        budget = request_context.Budget(items[0][2].deadline, items[0][2].traffic)
+        for _, _, item_budget in items[1:]:
+            budget.join(item_budget)
+        timeout, retry_timeout = self._call_timeouts(budget)
+        try:
+            responses = await self._send(
+                property_id, [item[0] for item in items], timeout, retry_timeout, budget.traffic
+            )
         except Exception as e:
-            return f"Error executing GA4 query: {str(e)}"
+            for _, future, *_ in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, *_), response in zip(items, responses):
+            if not future.done():
+                future.set_result(response)
 
-        # 5. Summarize results
-        summary = self._summarize_response(query, response)
-        return summary
+    async def _send(
+        self, property_id: str, requests: List[RunReportRequest], timeout: float, retry_timeout: float,
+        traffic: str,
+    ):
+        """One API call for up to GA4_BATCH_MAX_REPORTS reports of a property, admitted by the quota scheduler."""
+        await self.quota.acquire(property_id, traffic)
+        try:
+            retry = self._retry.with_timeout(retry_timeout)
+            with metrics.GA4_REPORT_LATENCY.time():
+                if len(requests) == 1:
+                    metrics.GA4_API_CALLS.labels(method="run_report").inc()
+                    responses = [await self._get_client().run_report(requests[0], retry=retry, timeout=timeout)]
+                else:
+                    metrics.GA4_API_CALLS.labels(method="batch_run_reports").inc()
+                    batch = await self._get_client().batch_run_reports(
+                        BatchRunReportsRequest(property=f"properties/{property_id}", requests=requests),
+                        retry=retry, timeout=timeout
+                    )
+                    responses = list(batch.reports)
+        except google_exceptions.ResourceExhausted as e:
+            self.quota.mark_exhausted(property_id)
+            raise QuotaExhausted(f"GA4 quota for property {property_id} is used up: {e.message}") from e
+        finally:
+            self.quota.release(property_id)
+        metrics.GA4_BATCHED_REPORTS.inc(len(requests))
+        if "property_quota" in responses[-1]:
+            self.quota.record(property_id, responses[-1].property_quota)
+        return responses
+
+    def _request_key(self, request: RunReportRequest) -> str:
+        """
+        Canonical key for a RunReportRequest.
+
+        Metrics and dimensions are sorted so their order does not matter;
+        order_bys and date ranges keep theirs since they change the result.
+        Dates are expected to be resolved already (see _build_request).
+        """
+        canonical = RunReportRequest.deserialize(RunReportRequest.serialize(request))
+        canonical.metrics = sorted(request.metrics, key=lambda m: m.name)
+        canonical.dimensions = sorted(request.dimensions, key=lambda d: d.name)
+        # Asking for the quota back does not change the report
+        canonical.return_property_quota = False
+        payload = RunReportRequest.to_json(canonical, sort_keys=True, indent=None)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
     def _validate_plan(self, plan: GA4QueryPlan) -> dict:
         """Validate and filter plan against safe allowlists."""
@@ -127,39 +624,38 @@ class AnalyticsAgent:
             if valid_order:
                 validated['order_by'] = valid_order
         
+        if plan.limit and plan.limit > 0:
+            validated['limit'] = plan.limit
+
         return validated
 
-    def _infer_plan_with_llm(self, query: str) -> GA4QueryPlan | None:
-        """Use LLM with structured output to infer GA4 query parameters."""
+    async def _infer_plans_with_llm(self, query: str) -> List[GA4QueryPlan] | None:
+        """Use LLM with structured output to infer GA4 query parameters (one plan per report)."""
         prompt = f"""You are a Google Analytics 4 (GA4) expert. 
 User Query: "{query}"
 
-Extract the parameters to query GA4 Data API:
-- metrics: List of metric names (e.g., "activeUsers", "screenPageViews", "sessions")
-- dimensions: List of dimension names (e.g., "date", "pagePath", "country")
-- date_ranges: List of date ranges with start_date and end_date (YYYY-MM-DD or relative like "7daysAgo", "yesterday")
-- order_by: Optional list of ordering with field name and desc (true/false)
-
-IMPORTANT: Use standard GA4 API metric and dimension names:
-- For users: activeUsers, newUsers, totalUsers
-- For views: screenPageViews
-- For sessions: sessions, engagedSessions
-- For pages: pagePath, pageTitle
-- For traffic: sessionSource, sessionMedium"""
+Extract the parameters to query GA4 Data API as a list of plans, each with:
+{GA4_PLAN_GUIDE}"""
         
         try:
-            result = llm_client.chat_structured(
+            result = await llm_client.chat_structured(
                 [{"role": "user", "content": prompt}],
-                response_model=GA4QueryPlan,
-                model="gemini-2.5-flash"
+                response_model=GA4ReportPlans,
+                model="gemini-2.5-flash",
+                stage=metrics.STAGE_GA4_PLAN
             )
-            return result
+            return result.plans
         except Exception as e:
             logger.error(f"LLM Error: {e}")
             return None
 
     def _build_request(self, property_id: str, plan: dict):
-        date_ranges = [DateRange(start_date=d['start_date'], end_date=d['end_date']) for d in plan.get('date_ranges', [])]
+        # Relative dates are pinned to absolute ones so the report and its cache key agree
+        today = property_today(property_id)
+        date_ranges = [
+            DateRange(start_date=resolve_date(d['start_date'], today), end_date=resolve_date(d['end_date'], today))
+            for d in plan.get('date_ranges', [])
+        ]
         metrics = [Metric(name=m) for m in plan.get('metrics', [])]
         dimensions = [Dimension(name=d) for d in plan.get('dimensions', [])]
         
@@ -180,38 +676,104 @@ IMPORTANT: Use standard GA4 API metric and dimension names:
             date_ranges=date_ranges,
             dimensions=dimensions,
             metrics=metrics,
-            order_bys=order_bys
+            order_bys=order_bys,
+            limit=max(min(GA4_PAGE_SIZE, GA4_ROW_BUDGET, plan.get('limit') or GA4_ROW_BUDGET), 1),
+            metric_aggregations=[MetricAggregation.TOTAL],
+            return_property_quota=True
         )
 
-    def _summarize_response(self, query: str, response):
-        # Convert response to text format for LLM summary
-        data_text = "GA4 Report:\n"
-        
-        # Headers
-        headers = [h.name for h in response.dimension_headers] + [h.name for h in response.metric_headers]
-        data_text +=  " | ".join(headers) + "\n"
-        
-        # Rows
-        for row in response.rows:
-            values = [v.value for v in row.dimension_values] + [v.value for v in row.metric_values]
-            data_text += " | ".join(values) + "\n"
-            
-        if not response.rows:
-            data_text += "No data returned.\n"
+    def _rows_event(self, frame: pd.DataFrame, preview_rows: int = 50) -> dict:
+        """Progress event payload for a fetched report: headers, row count and a preview."""
+        return {
+            "headers": list(frame.columns),
+            "row_count": frame.attrs.get("row_count", len(frame)),
+            "rows": frame.head(preview_rows).astype(str).values.tolist(),
+        }
+
+    def _response_frame(self, pages: List[RunReportResponse]) -> pd.DataFrame:
+        """
+        A report's pages as one columnar DataFrame.
+
+        Values are read column by column from the raw protobuf messages;
+        dimensions become categoricals and metrics numbers.
+        """
+        first = pages[0]
+        dimension_names = [h.name for h in first.dimension_headers]
+        metric_names = [h.name for h in first.metric_headers]
+        rows = [row for page in pages for row in RunReportResponse.pb(page).rows]
+        columns = {}
+        for i, name in enumerate(dimension_names):
+            columns[name] = pd.Categorical([row.dimension_values[i].value for row in rows])
+        for i, name in enumerate(metric_names):
+            columns[name] = pd.to_numeric(pd.Series([row.metric_values[i].value for row in rows], dtype=object), errors="coerce")
+        frame = pd.DataFrame(columns, columns=dimension_names + metric_names)
+
+        totals = []
+        for row in RunReportResponse.pb(first).totals:
+            total = {name: pd.to_numeric(v.value, errors="coerce") for name, v in zip(metric_names, row.metric_values)}
+            if DATE_RANGE_DIMENSION in dimension_names:
+                total[DATE_RANGE_DIMENSION] = row.dimension_values[dimension_names.index(DATE_RANGE_DIMENSION)].value
+            totals.append(total)
+        frame.attrs.update(
+            row_count=first.row_count, totals=totals, dimensions=dimension_names, metrics=metric_names
+        )
+        return frame
+
+    def _frames_text(self, frames: List[pd.DataFrame]) -> str:
+        """Plain rendering of one or more reports' rows (the first GA4_DIGEST_FULL_ROWS of each)."""
+        texts = []
+        for f in frames:
+            if f.empty:
+                texts.append("No data returned.")
+                continue
+            text = f.head(GA4_DIGEST_FULL_ROWS).to_string(index=False)
+            row_count = f.attrs.get("row_count", len(f))
+            if row_count > GA4_DIGEST_FULL_ROWS:
+                text += f"\n(first {GA4_DIGEST_FULL_ROWS} of {row_count:,} rows)"
+            texts.append(text)
+        if len(texts) == 1:
+            return texts[0]
+        return "\n\n".join(f"Report {i + 1}:\n{text}" for i, text in enumerate(texts))
+
+    async def _summarize_response(self, query: str, frames: List[pd.DataFrame]):
+        # Fixed-size digest of each report (totals, period deltas, top rows) for the LLM summary
+        digests = [
+            build_digest(
+                f, f.attrs.get("dimensions", []), f.attrs.get("metrics", []),
+                row_count=f.attrs.get("row_count"), totals=f.attrs.get("totals")
+            )
+            for f in frames
+        ]
+        if len(digests) == 1:
+            data_text = f"GA4 Report:\n{digests[0]}"
+        else:
+            data_text = "\n\n".join(f"GA4 Report {i + 1}:\n{d}" for i, d in enumerate(digests))
 
         prompt = f"""
         User Query: "{query}"
-        Data Context:
+        Data digest:
         {data_text}
         
-        Provide a concise natural language answer to the user's query based on the data above.
+        Provide a concise natural language answer to the user's query based on the data digest above
+        (totals cover every matched row; row listings may be the top rows only).
         If the data is empty, explain that no data was found for the requested period.
         """
-        
-        return llm_client.chat_structured(
+
+        if request_context.stream_tokens():
+            return await request_context.relay_tokens(llm_client.chat_stream(
+                [{"role": "user", "content": prompt}],
+                model="gemini-2.5-flash",
+                priority=PRIORITY_LOW,
+                stage=metrics.STAGE_GA4_SUMMARY
+            ))
+
+        result = await llm_client.chat_structured(
             [{"role": "user", "content": prompt}],
             response_model=AnalysisSummary,
-            model="gemini-2.5-flash"
-        ).summary
+            model="gemini-2.5-flash",
+            priority=PRIORITY_LOW,
+            stage=metrics.STAGE_GA4_SUMMARY
+        )
+        return result.summary
 
 analytics_agent = AnalyticsAgent()
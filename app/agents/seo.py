@@ -1,3 +1,6 @@
+import asyncio
+import ctypes
+import hashlib
 import logging
 import os
 import re
@@ -6,9 +9,16 @@ import pandas as pd
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from dotenv import load_dotenv
+import threading
 import time
-from app.llm.client import llm_client
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from app.llm.client import TokenBucket, llm_client
 from app.llm.schemas import SEOCodeResponse
+from app.models import AgentResult
+from app.plan_cache import plan_cache, seo_key
+from app import metrics, request_context, seo_snapshot
 
 load_dotenv()
 
@@ -17,6 +27,14 @@ logger = logging.getLogger(__name__)
 CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS_FILE", "credentials.json")
 SPREADSHEETS_CONFIG_FILE = os.getenv("SPREADSHEETS_CONFIG_FILE", "spreadsheets.json")
 
+# Spreadsheets loaded concurrently at startup, and the shared Sheets API read budget
+SHEETS_LOAD_WORKERS = int(os.getenv("SHEETS_LOAD_WORKERS", "4"))
+SHEETS_REQUESTS_PER_MINUTE = float(os.getenv("SHEETS_REQUESTS_PER_MINUTE", "60"))
+SHEETS_MAX_RETRIES = 5
+
+# Numbers as numbers (no re-parsing of formatted strings), dates as displayed
+SHEETS_VALUE_PARAMS = {"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "FORMATTED_STRING"}
+
 
 def extract_spreadsheet_id(source: str) -> str:
     """
@@ -66,14 +84,210 @@ def load_spreadsheet_configs() -> list:
         logger.error(f"Error reading spreadsheets config: {e}")
         return []
 
+class SheetsRateLimiter:
+    """
+    Process-wide Sheets API budget shared by the loader threads.
+
+    Requests are paced by a requests/min token bucket; a 429 pauses every
+    caller for the backoff instead of each thread retrying on its own.
+    """
+
+    def __init__(self, per_minute: float = SHEETS_REQUESTS_PER_MINUTE):
+        self._bucket = TokenBucket(per_minute)
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(self._paused_until - now, self._bucket.wait_time(1, now))
+                if wait <= 0:
+                    self._bucket.consume(1)
+                    return
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def call(self, fn, *args, **kwargs):
+        """Run one Sheets API call under the budget, backing off on 429."""
+        for attempt in range(SHEETS_MAX_RETRIES):
+            self.acquire()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if "429" in str(e) and attempt < SHEETS_MAX_RETRIES - 1:
+                    wait_time = (2 ** attempt) + 1  # Exponential backoff: 2, 3, 5, 9...
+                    logger.warning(f"Sheets rate limit hit. Retrying in {wait_time}s... (Attempt {attempt + 1}/{SHEETS_MAX_RETRIES})")
+                    self.pause(wait_time)
+                else:
+                    raise
+
+
+sheets_limiter = SheetsRateLimiter()
+
+
+def _quote_range(title: str) -> str:
+    """A worksheet title as an A1 range covering the whole sheet."""
+    return "'" + title.replace("'", "''") + "'"
+
+
+def values_to_frame(values: list) -> Optional[pd.DataFrame]:
+    """Header row plus data rows as a DataFrame; None when there are no data rows."""
+    if len(values) <= 1:
+        return None
+    headers = values[0]
+    width = len(headers)
+    # The API drops trailing empty cells; pad them back as blanks
+    rows = [row[:width] + [""] * (width - len(row)) for row in values[1:]]
+    return pd.DataFrame(rows, columns=headers)
+
+
+def _revision(spreadsheet) -> Optional[str]:
+    """Drive modifiedTime of the spreadsheet, or None when it cannot be read."""
+    try:
+        return sheets_limiter.call(spreadsheet.get_lastUpdateTime)
+    except Exception as e:
+        logger.warning(f"Could not read the revision of spreadsheet '{spreadsheet.id}': {e}")
+        return None
+
+
+def fetch_revision(creds, config: dict) -> Optional[str]:
+    client = gspread.authorize(creds)
+    return _revision(sheets_limiter.call(client.open_by_key, extract_spreadsheet_id(config["source"])))
+
+
+def load_spreadsheet(creds, config: dict) -> tuple:
+    """
+    Load every worksheet of one configured spreadsheet as ({key: DataFrame}, revision).
+
+    All worksheets are fetched with a single values_batch_get call; if that
+    fails (e.g. the response is too large) each worksheet is fetched on its own.
+    The revision is read first, so an edit made during the load shows up as
+    a newer revision on the next check.
+    """
+    spreadsheet_name = config.get("name", "unnamed")
+    spreadsheet_id = extract_spreadsheet_id(config["source"])
+    logger.info(f"Loading spreadsheet '{spreadsheet_name}' (ID: {spreadsheet_id})")
+    started = time.monotonic()
+
+    # One client per thread: gspread's HTTP session is not shared across threads
+    client = gspread.authorize(creds)
+    spreadsheet = sheets_limiter.call(client.open_by_key, spreadsheet_id)
+    revision = _revision(spreadsheet)
+    titles = [worksheet.title for worksheet in sheets_limiter.call(spreadsheet.worksheets)]
+    ranges = [_quote_range(title) for title in titles]
+
+    try:
+        fetch_started = time.monotonic()
+        response = sheets_limiter.call(spreadsheet.values_batch_get, ranges, params=SHEETS_VALUE_PARAMS)
+        # One call for every worksheet, so the fetch time is only known per batch
+        value_ranges = [(v.get("values", []), None) for v in response.get("valueRanges", [])]
+        logger.info(
+            f"Fetched {len(ranges)} worksheet(s) of '{spreadsheet_name}' in one batch in {time.monotonic() - fetch_started:.2f}s"
+        )
+    except Exception as e:
+        logger.warning(f"Batch read of '{spreadsheet_name}' failed ({e}); fetching worksheets one by one")
+        value_ranges = []
+        for sheet_range in ranges:
+            fetch_started = time.monotonic()
+            response = sheets_limiter.call(spreadsheet.values_get, sheet_range, params=SHEETS_VALUE_PARAMS)
+            value_ranges.append((response.get("values", []), time.monotonic() - fetch_started))
+
+    dfs = {}
+    for title, (values, fetch_seconds) in zip(titles, value_ranges):
+        # Create a unique key combining spreadsheet name and sheet name
+        key = f"{spreadsheet_name}__{title}".lower().replace(" ", "_")
+        parse_started = time.monotonic()
+        df = values_to_frame(values)
+        if df is None:
+            continue
+        dfs[key] = df
+        fetch = "" if fetch_seconds is None else f"fetch {fetch_seconds:.2f}s, "
+        logger.info(f"Loaded sheet: {key} ({len(df)} rows; {fetch}parse {time.monotonic() - parse_started:.2f}s)")
+    logger.info(f"Loaded spreadsheet '{spreadsheet_name}': {len(dfs)} sheet(s) in {time.monotonic() - started:.2f}s")
+    return dfs, revision
+
+
+# Asked for when the result will be joined with GA4 rows
+TABULAR_INSTRUCTION = (
+    "- Set `result` to a DataFrame (not a string) that keeps the page URL column "
+    "(e.g. 'Address') together with the columns relevant to the request."
+)
+
+GENERATED_CODE_FILENAME = "<seo_analysis>"
+
+
+def run_generated_code(code, local_vars: dict, deadline: Optional[float] = None):
+    """
+    exec() generated analysis code (source or a compiled code object) in the calling (worker) thread.
+
+    With a deadline (a time.monotonic() value) a timer raises DeadlineExceeded
+    inside this thread once it passes, so runaway loops stop instead of
+    holding the worker forever. A single long-running C call (e.g. one big
+    pandas operation) is only interrupted when it returns to Python.
+    """
+    compiled = code if isinstance(code, types.CodeType) else compile(code, GENERATED_CODE_FILENAME, "exec")
+    if deadline is None:
+        exec(compiled, local_vars)
+        return
+
+    thread_id = ctypes.c_ulong(threading.get_ident())
+    lock = threading.Lock()
+    running = [True]
+
+    def interrupt():
+        with lock:
+            if running[0]:
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, ctypes.py_object(request_context.DeadlineExceeded))
+
+    timer = threading.Timer(max(deadline - time.monotonic(), 0), interrupt)
+    timer.daemon = True
+    timer.start()
+    try:
+        exec(compiled, local_vars)
+    finally:
+        timer.cancel()
+        with lock:
+            running[0] = False
+            # Drop an interrupt that fired too late to land inside the generated code
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, None)
+
 
 class SEOAgent:
     def __init__(self):
         self.dfs = {}
+        # Fingerprint of the loaded sheets; changes whenever refreshed data differs
+        self.data_version = ""
+        # Fingerprint of sheet names and columns only; keys memoized analysis code
+        self.schema_version = ""
+        # Spreadsheet name -> {"id", "revision", "sheets"} for the data being served
+        self._sources = {}
         self._load_data()
 
-    def _load_data(self):
-        """Load SEO data from multiple Google Sheets using service account credentials."""
+    def _fingerprint(self, dfs: dict) -> str:
+        digest = hashlib.sha256()
+        for key in sorted(dfs):
+            df = dfs[key]
+            digest.update(key.encode("utf-8"))
+            digest.update(json.dumps([str(c) for c in df.columns]).encode("utf-8"))
+            digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+        return digest.hexdigest()[:16]
+
+    def _schema_fingerprint(self, dfs: dict) -> str:
+        schema = {key: [str(c) for c in df.columns] for key, df in dfs.items()}
+        return hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def _credentials(self):
+        scope = [
+            "https://spreadsheets.google.com/feeds",
+            "https://www.googleapis.com/auth/drive"
+        ]
+        return ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
+
+    def _configs(self) -> list:
         if not os.path.exists(CREDENTIALS_FILE):
             raise RuntimeError(
                 f"Credentials file '{CREDENTIALS_FILE}' not found. "
@@ -86,99 +300,224 @@ class SEOAgent:
                 f"No spreadsheets configured. Please add spreadsheets to '{SPREADSHEETS_CONFIG_FILE}'."
             )
 
+        configs = []
+        for config in spreadsheet_configs:
+            if not config.get("source", ""):
+                logger.warning(f"Skipping spreadsheet '{config.get('name', 'unnamed')}': no source provided")
+                continue
+            configs.append(config)
+        return configs
+
+    def _load_data(self):
+        """
+        Load SEO data, from the local snapshot when it matches the configured spreadsheets.
+
+        A snapshot is served immediately and revalidated against Google Sheets
+        in a background thread; without one, the sheets are loaded before
+        returning and written as the new snapshot.
+        """
+        configs = self._configs()
+        if seo_snapshot.SEO_SNAPSHOT_ENABLED and self._load_snapshot(configs):
+            threading.Thread(target=self._revalidate, args=(configs,), name="seo-snapshot-revalidate", daemon=True).start()
+            return
+        self._load_from_sheets(configs)
+
+    def _load_from_sheets(self, configs: list):
+        """Load SEO data from multiple Google Sheets using service account credentials."""
         try:
-            scope = [
-                "https://spreadsheets.google.com/feeds",
-                "https://www.googleapis.com/auth/drive"
-            ]
+            started = time.monotonic()
+            dfs, sources = self._fetch(configs, self._credentials())
+            if not dfs:
+                raise RuntimeError("No data loaded from any Google Sheets.")
+            self._install(dfs, sources)
+            logger.info(
+                f"SEO Agent: Loaded {len(self.dfs)} sheets from {len(configs)} spreadsheet(s)"
+                f" in {time.monotonic() - started:.2f}s"
+            )
 
-            creds = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
-            client = gspread.authorize(creds)
+        except Exception as e:
+            logger.error(f"Error loading from Google Sheets: {e}")
+            raise RuntimeError(f"Failed to load SEO data: {e}")
 
-            for config in spreadsheet_configs:
-                spreadsheet_name = config.get("name", "unnamed")
-                source = config.get("source", "")
-                
-                if not source:
-                    logger.warning(f"Skipping spreadsheet '{spreadsheet_name}': no source provided")
-                    continue
-                
-                spreadsheet_id = extract_spreadsheet_id(source)
-                logger.info(f"Loading spreadsheet '{spreadsheet_name}' (ID: {spreadsheet_id})")
-                
+    def _fetch(self, configs: list, creds) -> tuple:
+        """Load the given spreadsheets concurrently as ({key: DataFrame}, sources); failed ones are skipped."""
+        dfs, sources = {}, {}
+        # Spreadsheets load concurrently, so startup takes about as long as the largest one
+        with ThreadPoolExecutor(max_workers=max(1, min(SHEETS_LOAD_WORKERS, len(configs)))) as pool:
+            futures = [(config, pool.submit(load_spreadsheet, creds, config)) for config in configs]
+            for config, future in futures:
+                name = config.get("name", "unnamed")
                 try:
-                    spreadsheet = client.open_by_key(spreadsheet_id)
-                    
-                    for worksheet in spreadsheet.worksheets():
-                        sheet_name = worksheet.title
-                        # Create a unique key combining spreadsheet name and sheet name
-                        key = f"{spreadsheet_name}__{sheet_name}".lower().replace(" ", "_")
-
-                        # Simple retry mechanism for Rate Limit (429)
-                        max_retries = 5
-                        for attempt in range(max_retries):
-                            try:
-                                data = worksheet.get_all_records()
-                                if data:
-                                    self.dfs[key] = pd.DataFrame(data)
-                                    logger.info(f"Loaded sheet: {key} ({len(data)} rows)")
-                                else:
-                                    values = worksheet.get_all_values()
-                                    if len(values) > 1:
-                                        headers = values[0]
-                                        rows = values[1:]
-                                        self.dfs[key] = pd.DataFrame(rows, columns=headers)
-                                        logger.info(f"Loaded sheet: {key} ({len(rows)} rows)")
-                                break  # Success, exit retry loop
-                            except Exception as e:
-                                if "429" in str(e) and attempt < max_retries - 1:
-                                    wait_time = (2 ** attempt) + 1  # Exponential backoff: 2, 3, 5, 9...
-                                    logger.warning(f"Rate limit hit for '{sheet_name}'. Retrying in {wait_time}s... (Attempt {attempt + 1}/{max_retries})")
-                                    time.sleep(wait_time)
-                                else:
-                                    raise e  # Re-raise if not 429 or out of retries
-                                
+                    sheets, revision = future.result()
                 except Exception as e:
-                    logger.error(f"Error loading spreadsheet '{spreadsheet_name}': {e}")
+                    logger.error(f"Error loading spreadsheet '{name}': {e}")
                     continue
+                dfs.update(sheets)
+                sources[name] = {
+                    "id": extract_spreadsheet_id(config["source"]),
+                    "revision": revision,
+                    "sheets": sorted(sheets),
+                }
+        return dfs, sources
 
-            if not self.dfs:
-                raise RuntimeError("No data loaded from any Google Sheets.")
+    def _install(self, dfs: dict, sources: dict):
+        """Serve dfs, persisting them as the snapshot first when enabled (the snapshot is what gets served)."""
+        manifest = None
+        if seo_snapshot.SEO_SNAPSHOT_ENABLED:
+            try:
+                # Workers sharing the directory write and publish one at a time
+                with seo_snapshot.lock():
+                    manifest = seo_snapshot.write_snapshot(dfs, sources)
+                    mapped = seo_snapshot.map_snapshot(manifest)
+                    manifest.update(
+                        data_version=self._fingerprint(mapped), schema_version=self._schema_fingerprint(mapped)
+                    )
+                    seo_snapshot.publish(manifest)
+                # Serve the mapped copy, so fresh loads and snapshot boots see identical frames
+                dfs = mapped
+            except Exception as e:
+                logger.error(f"Could not write SEO snapshot: {e}")
+                manifest = None
+
+        if manifest is not None:
+            data_version, schema_version = manifest["data_version"], manifest["schema_version"]
+        else:
+            data_version, schema_version = self._fingerprint(dfs), self._schema_fingerprint(dfs)
+
+        self.dfs = dfs
+        self._sources = sources
+        self.schema_version = schema_version
+        self.data_version = data_version
+
+    def _load_snapshot(self, configs: list) -> bool:
+        """Serve the snapshot if it covers exactly the configured spreadsheets."""
+        started = time.monotonic()
+        loaded = seo_snapshot.load_snapshot()
+        if loaded is None:
+            return False
+        dfs, manifest = loaded
+        wanted = {config.get("name", "unnamed"): extract_spreadsheet_id(config["source"]) for config in configs}
+        if {name: source["id"] for name, source in manifest["spreadsheets"].items()} != wanted:
+            logger.info("SEO snapshot does not match the configured spreadsheets; loading from Google Sheets")
+            return False
 
-            logger.info(f"SEO Agent: Loaded {len(self.dfs)} sheets from {len(spreadsheet_configs)} spreadsheet(s)")
+        self.dfs = dfs
+        self._sources = manifest["spreadsheets"]
+        self.schema_version = manifest["schema_version"]
+        self.data_version = manifest["data_version"]
+        logger.info(f"SEO Agent: Serving {len(dfs)} sheets from snapshot in {time.monotonic() - started:.2f}s")
+        return True
 
+    def _revalidate(self, configs: list):
+        """Reload spreadsheets whose revision differs from the snapshot and swap them in."""
+        try:
+            creds = self._credentials()
+            with ThreadPoolExecutor(max_workers=max(1, min(SHEETS_LOAD_WORKERS, len(configs)))) as pool:
+                revisions = list(pool.map(lambda config: fetch_revision(creds, config), configs))
+            stale = [
+                config for config, revision in zip(configs, revisions)
+                if revision is None or revision != self._sources[config.get("name", "unnamed")]["revision"]
+            ]
+            if not stale:
+                logger.info("SEO snapshot is up to date")
+                return
+
+            logger.info(f"Refreshing {len(stale)} changed spreadsheet(s) from Google Sheets")
+            fresh, fresh_sources = self._fetch(stale, creds)
+            replaced = {key for name in fresh_sources for key in self._sources[name]["sheets"]}
+            dfs = {key: df for key, df in self.dfs.items() if key not in replaced}
+            dfs.update(fresh)
+            self._install(dfs, {**self._sources, **fresh_sources})
+            logger.info(f"SEO Agent: Refreshed snapshot, data version {self.data_version}")
         except Exception as e:
-            logger.error(f"Error loading from Google Sheets: {e}")
-            raise RuntimeError(f"Failed to load SEO data: {e}")
+            logger.error(f"SEO snapshot revalidation failed; serving the snapshot: {e}")
 
     def refresh_data(self):
         """Manually refresh data from Google Sheets."""
-        self.dfs = {}
-        self._load_data()
+        self._load_from_sheets(self._configs())
 
     async def process_query(self, query: str):
-        # 1. Generate Python code to answer prediction
-        code = self._generate_code(query)
-        if not code:
-            return "I could not generate a solution for that SEO request."
-            
-        logger.debug(f"Generated Code:\n{code}")
+        result = await self.run_query(query)
+        return result.text
+
+    async def run_query(self, query: str, tabular: bool = False) -> AgentResult:
+        """
+        Answer a query, keeping the result as a DataFrame when the generated code produced one.
+
+        With tabular=True the generated code is asked to return a DataFrame
+        that includes the URL column, so it can be joined with GA4 rows.
+        """
+        # 1. Generate Python code to answer prediction (memoized per question and sheet schema)
+        key = seo_key(query, self.schema_version, tabular)
+        code = plan_cache.get(key)
+        memoized = code is not None
+        if not memoized:
+            source = await self._generate_code(query, tabular)
+            if not source:
+                request_context.mark_degraded("seo: no code generated")
+                return AgentResult(text="I could not generate a solution for that SEO request.")
+            logger.debug(f"Generated Code:\n{source}")
+            code = self._compile(source)
 
         # 2. Execute Code
         try:
             # Sandbox environment
             local_vars = {"dfs": self.dfs, "pd": pd}
-            exec(code, local_vars)
+            left = request_context.remaining()
+            deadline = None if left is None else time.monotonic() + left
+            with metrics.SEO_EXEC_LATENCY.time():
+                # Off the event loop so concurrent branches (e.g. GA4) keep making progress
+                await request_context.within_deadline(
+                    asyncio.to_thread(run_generated_code, code, local_vars, deadline)
+                )
             
             # Expect result in 'result' variable
             if "result" in local_vars:
-                return str(local_vars["result"])
+                if not memoized and isinstance(code, types.CodeType):
+                    # Only code that ran and produced a result is reused
+                    plan_cache.set(key, code)
+                value = local_vars["result"]
+                if isinstance(value, pd.Series):
+                    value = value.to_frame()
+                frame = value if isinstance(value, pd.DataFrame) else None
+                result = str(value)
+                request_context.emit("seo_result", {"result": result})
+                return AgentResult(text=result, frame=frame)
             else:
-                return "The generated analysis code did not return a 'result' variable."
+                request_context.mark_degraded("seo: no result variable")
+                return AgentResult(text="The generated analysis code did not return a 'result' variable.")
+        except request_context.DeadlineExceeded:
+            request_context.mark_degraded("seo: execution stopped at deadline")
+            return AgentResult(text="The SEO analysis was stopped because the request deadline was reached.")
         except Exception as e:
-            return f"Error executing analysis code: {str(e)}"
+            request_context.mark_degraded("seo: execution error")
+            return AgentResult(text=f"Error executing analysis code: {str(e)}")
+
+    def _compile(self, source: str):
+        """Compiled code object, or the source itself when it does not compile (exec reports the error)."""
+        try:
+            return compile(source, GENERATED_CODE_FILENAME, "exec")
+        except SyntaxError:
+            return source
+
+    async def warm_code(self, entries: list):
+        """Pin the given code ({"query", "code", "tabular"}) or generate it for listed questions ({"query"})."""
+        # Pinned entries first, so they apply before any LLM call is awaited
+        for entry in sorted(entries, key=lambda e: not e.get("code")):
+            query, tabular = entry["query"], entry.get("tabular", False)
+            try:
+                if entry.get("code"):
+                    code = compile(entry["code"], GENERATED_CODE_FILENAME, "exec")
+                    plan_cache.set(seo_key(query, self.schema_version, tabular), code, pinned=True)
+                else:
+                    source = await self._generate_code(query, tabular)
+                    code = self._compile(source) if source else None
+                    if isinstance(code, types.CodeType):
+                        plan_cache.set(seo_key(query, self.schema_version, tabular), code)
+            except Exception as e:
+                logger.error(f"Could not warm SEO code for {entry!r}: {e}")
 
-    def _generate_code(self, query: str):
+    async def _generate_code(self, query: str, tabular: bool = False):
         # Prepare context about available dataframes
         schema_info = "Available Dataframes (in 'dfs' dictionary):\n"
         for name, df in self.dfs.items():
@@ -200,16 +539,18 @@ class SEOAgent:
         - Handle case insensitivity if checking string contents.
         - Do not answer the question directly. Write Python code to calculate it.
         - If data is missing or query is impossible, write code that sets `result` to an error message string.
+        {TABULAR_INSTRUCTION if tabular else ""}
         
         Example:
         result = str(dfs['internal_all'].head(5))
         """
         
         try:
-            response = llm_client.chat_structured(
+            response = await llm_client.chat_structured(
                 messages=[{"role": "user", "content": prompt}],
                 response_model=SEOCodeResponse,
-                model="gemini-2.5-flash"
+                model="gemini-2.5-flash",
+                stage=metrics.STAGE_SEO_CODEGEN
             )
             return response.code.strip()
         except Exception as e:
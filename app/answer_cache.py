@@ -0,0 +1,92 @@
+"""
+Full-answer cache for the orchestrator.
+
+Entries are keyed on (normalized query, propertyId, data version), where the
+data version combines the loaded SEO data fingerprint with the current date
+for GA4 queries, so answers over relative date ranges ("7daysAgo") expire
+when the day rolls over. Memory is bounded by entry count and total answer
+size; entries also expire after a TTL.
+"""
+
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "900"))
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase and collapse whitespace so trivially different phrasings share an entry."""
+    return " ".join(query.lower().split())
+
+
+def make_key(query: str, property_id: Optional[str], data_version: str) -> str:
+    payload = json.dumps([normalize_query(query), property_id, data_version])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        max_bytes: int = ANSWER_CACHE_MAX_BYTES,
+        ttl: float = ANSWER_CACHE_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # key -> (expires_at, answer, size in bytes)
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, answer, _ = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return answer
+            self._remove(key)
+        self.misses += 1
+        return None
+
+    def set(self, key: str, answer: str):
+        size = len(answer.encode("utf-8"))
+        if self.ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.time() + self.ttl, answer, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,90 @@
+"""
+Local join of GA4 and SEO results for multi-agent queries.
+
+GA4 reports key pages by path (`pagePath`, `landingPage`, ...) while
+Screaming Frog exports key them by full URL (`Address`). Both sides are
+normalized to a lowercase path without trailing slash and merged with
+pandas, so the LLM only has to narrate the already-matched rows.
+"""
+
+import json
+from typing import Optional
+
+import pandas as pd
+
+# GA4 dimensions holding a page path or URL, in order of preference
+GA4_URL_DIMENSIONS = ("pagePath", "pagePathPlusQueryString", "landingPage", "landingPagePlusQueryString", "fullPageUrl")
+# Screaming Frog URL columns, in order of preference
+SEO_URL_COLUMNS = ("Address", "URL", "Url", "url", "address")
+
+JOIN_KEY = "_url_key"
+
+
+def normalize_urls(urls: pd.Series) -> pd.Series:
+    """
+    Vectorized URL/path normalization for matching GA4 and SEO rows.
+
+    Full URLs are reduced to their path (scheme, host, query and fragment
+    dropped); paths are lowercased and lose their trailing slash, with the
+    root kept as "/".
+    """
+    urls = urls.astype("string").str.strip()
+    is_absolute = urls.str.match(r"(?i)^https?://")
+    paths = urls.where(
+        ~is_absolute,
+        urls.str.replace(r"(?i)^https?://[^/?#]*", "", regex=True).str.replace(r"[?#].*$", "", regex=True),
+    )
+    paths = paths.str.lower().str.rstrip("/")
+    return paths.mask((paths == "").fillna(False), "/")
+
+
+def find_url_column(frame: pd.DataFrame, candidates) -> Optional[str]:
+    """First candidate column present in frame, else the first column that looks like URLs or paths."""
+    for name in candidates:
+        if name in frame.columns:
+            return name
+    for name in frame.columns:
+        sample = frame[name].dropna().astype(str).head(20)
+        if len(sample) and sample.str.match(r"^(https?://|/)").all():
+            return name
+    return None
+
+
+def join_results(
+    ga4: Optional[pd.DataFrame], seo: Optional[pd.DataFrame], limit: int, seo_filter: bool = False
+) -> Optional[pd.DataFrame]:
+    """
+    Merge GA4 rows with SEO rows on normalized URL and keep the top `limit` rows.
+
+    GA4 order (e.g. by views) is preserved. When the SEO rows are a filter
+    (e.g. only non-indexable pages) only matching GA4 rows are kept;
+    otherwise pages missing from the crawl keep empty SEO columns. When only
+    one side has a table, that table is returned trimmed to `limit`. None
+    when neither does, or when both do but one has no URL column to join on
+    (the caller falls back to fusing the text results).
+    """
+    ga4 = ga4 if ga4 is not None and not ga4.empty else None
+    seo = seo if seo is not None and not seo.empty else None
+    limit = max(limit, 1)
+
+    ga4_url = find_url_column(ga4, GA4_URL_DIMENSIONS) if ga4 is not None else None
+    seo_url = find_url_column(seo, SEO_URL_COLUMNS) if seo is not None else None
+    if ga4 is not None and seo is not None and (ga4_url is None or seo_url is None):
+        return None
+    if ga4 is None or seo is None:
+        table = ga4 if ga4 is not None else seo
+        return table.head(limit).reset_index(drop=True) if table is not None else None
+
+    left = ga4.assign(**{JOIN_KEY: normalize_urls(ga4[ga4_url])})
+    right = seo.assign(**{JOIN_KEY: normalize_urls(seo[seo_url])}).dropna(subset=[JOIN_KEY]).drop_duplicates(JOIN_KEY)
+    # Columns both sides share (other than the key) keep GA4's values
+    right = right.drop(columns=[c for c in right.columns if c in left.columns and c != JOIN_KEY])
+
+    joined = left.merge(right, on=JOIN_KEY, how="inner" if seo_filter else "left", sort=False)
+    return joined.drop(columns=JOIN_KEY).head(limit).reset_index(drop=True)
+
+
+def to_records_json(table: pd.DataFrame) -> str:
+    """Render a joined table as a JSON array of objects (missing values as null)."""
+    records = table.astype(object).where(table.notna(), None).to_dict(orient="records")
+    return json.dumps(records, indent=2, default=str)
@@ -0,0 +1,237 @@
+"""
+Fixed-size digests of GA4 reports for the summarizer.
+
+However many rows a report has, the LLM gets the same bounded context:
+totals (computed by GA4 over every matching row), per-date-range totals with
+deltas for period comparisons, a short trend over time dimensions, and the
+top-N rows by the leading metric. Small reports are passed through whole.
+
+Simple report shapes (a single number, a top-N ranking, a short date
+series) are answered from a template instead, skipping the summary call.
+"""
+
+import numbers
+import os
+import re
+from typing import List, Optional
+
+import pandas as pd
+
+GA4_DIGEST_TOP_N = int(os.getenv("GA4_DIGEST_TOP_N", "10"))
+# Reports with at most this many rows are shown in full instead of digested
+GA4_DIGEST_FULL_ROWS = int(os.getenv("GA4_DIGEST_FULL_ROWS", "50"))
+
+# Date series longer than this go to the summarizer instead of a template answer
+GA4_TEMPLATE_MAX_PERIODS = int(os.getenv("GA4_TEMPLATE_MAX_PERIODS", "31"))
+
+# Dimensions whose values order chronologically as strings (e.g. 20240131)
+TIME_DIMENSIONS = ("date", "dateHour", "dateHourMinute", "yearMonth", "yearWeek", "year", "month", "week", "hour")
+DATE_RANGE_DIMENSION = "dateRange"  # Added by GA4 when a report has several date ranges
+
+# Questions asking for more than the numbers (averages, explanations, trends) go to the summarizer
+_ANALYSIS_RE = re.compile(
+    r"\b(average|avg|mean|median|explain|why|whether|trend\w*|increas\w*|decreas\w*|grow\w*|declin\w*|"
+    r"insight\w*|analy[sz]\w*|recommend\w*|suggest\w*|interpret\w*|forecast\w*|predict\w*)\b",
+    re.IGNORECASE,
+)
+
+
+def _is_ratio(metric: str) -> bool:
+    lowered = metric.lower()
+    return any(part in lowered for part in ("rate", "per", "average"))
+
+
+def is_additive(metric: str) -> bool:
+    """
+    Counts can be summed across rows; rates, averages and ratios cannot.
+
+    Neither can user counts (activeUsers, totalPurchasers, ...): GA4
+    de-duplicates users across rows, so only its TOTAL row is exact.
+    """
+    lowered = metric.lower()
+    return not _is_ratio(metric) and not lowered.endswith(("users", "purchasers"))
+
+
+def _report_total(frame: pd.DataFrame, metric: str):
+    """GA4's TOTAL row value for metric (single date range), or None."""
+    totals = frame.attrs.get("totals") or []
+    if len(totals) != 1 or pd.isna(totals[0].get(metric)):
+        return None
+    return totals[0][metric]
+
+
+def _format(value) -> str:
+    if isinstance(value, numbers.Integral):
+        return f"{value:,}"
+    if isinstance(value, numbers.Real):
+        return f"{value:,.4g}" if abs(value) < 1 else f"{value:,.2f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+def _change(old: float, new: float) -> str:
+    if not old:
+        return "n/a"
+    return f"{(new - old) / abs(old):+.1%}"
+
+
+def _aggregate(frame: pd.DataFrame, by: List[str], metric_names: List[str]) -> pd.DataFrame:
+    """Group rows by dimensions, summing counts and averaging ratios."""
+    how = {m: ("sum" if is_additive(m) else "mean") for m in metric_names}
+    return frame.groupby(by, observed=True, sort=False).agg(how).reset_index()
+
+
+def build_digest(
+    frame: pd.DataFrame,
+    dimension_names: List[str],
+    metric_names: List[str],
+    row_count: Optional[int] = None,
+    totals: Optional[List[dict]] = None,
+    top_n: int = GA4_DIGEST_TOP_N,
+    full_rows: int = GA4_DIGEST_FULL_ROWS,
+) -> str:
+    """
+    Render a bounded text digest of one report.
+
+    row_count is the number of rows GA4 matched (the frame may hold only the
+    fetched budget); totals are GA4's TOTAL aggregation rows as
+    {metric: value}, one per date range (keyed by "dateRange") when there
+    are several.
+    """
+    fetched = len(frame)
+    row_count = fetched if row_count is None else row_count
+    lines = [f"Rows: {row_count:,} matched" + (f", {fetched:,} fetched" if fetched < row_count else "")]
+    if fetched == 0:
+        lines.append("No data returned.")
+        return "\n".join(lines)
+
+    if totals:
+        lines.append("Totals (all matched rows):")
+        for row in totals:
+            values = ", ".join(f"{m}={_format(v)}" for m, v in row.items() if m != DATE_RANGE_DIMENSION)
+            lines.append(f"  {row[DATE_RANGE_DIMENSION]}: {values}" if DATE_RANGE_DIMENSION in row else f"  {values}")
+    elif metric_names:
+        summed = _aggregate(frame.assign(_all=0), ["_all"], metric_names).iloc[0]
+        lines.append("Totals (fetched rows): " + ", ".join(f"{m}={_format(summed[m])}" for m in metric_names))
+
+    # Period comparison: GA4's per-range totals when available, else the fetched rows
+    if DATE_RANGE_DIMENSION in frame and metric_names:
+        if totals and all(DATE_RANGE_DIMENSION in row for row in totals):
+            per_range = pd.DataFrame(totals).set_index(DATE_RANGE_DIMENSION)
+        else:
+            per_range = _aggregate(frame, [DATE_RANGE_DIMENSION], metric_names).set_index(DATE_RANGE_DIMENSION)
+        ranges = sorted(per_range.index)
+        for name in ranges[1:]:
+            deltas = ", ".join(f"{m} {_change(per_range.loc[ranges[0], m], per_range.loc[name, m])}" for m in metric_names)
+            lines.append(f"Change {ranges[0]} -> {name}: {deltas}")
+
+    if fetched <= full_rows:
+        lines.append("All rows:")
+        lines.append(frame.to_string(index=False))
+        return "\n".join(lines)
+
+    time_dims = [d for d in dimension_names if d in TIME_DIMENSIONS]
+    if time_dims and metric_names:
+        series = _aggregate(frame, [time_dims[0]], metric_names).sort_values(time_dims[0])
+        first, last = series.iloc[0], series.iloc[-1]
+        lead = metric_names[0]
+        peak = series.loc[series[lead].idxmax()]
+        lines.append(
+            f"Trend by {time_dims[0]} ({len(series)} periods): {lead} {_format(first[lead])} on {first[time_dims[0]]}"
+            f" -> {_format(last[lead])} on {last[time_dims[0]]} ({_change(first[lead], last[lead])}),"
+            f" peak {_format(peak[lead])} on {peak[time_dims[0]]}"
+        )
+        lines.append(f"Last {min(top_n, len(series))} periods:")
+        lines.append(series.tail(top_n).to_string(index=False))
+
+    group_dims = [d for d in dimension_names if d not in TIME_DIMENSIONS and d != DATE_RANGE_DIMENSION]
+    if metric_names:
+        lead = metric_names[0]
+        top = _aggregate(frame, group_dims, metric_names) if group_dims else frame
+        top = top.nlargest(top_n, lead)
+        lines.append(f"Top {len(top)} by {lead}" + (f" (per {', '.join(group_dims)})" if group_dims else "") + ":")
+        lines.append(top.to_string(index=False))
+    return "\n".join(lines)
+
+
+def _label(name: str) -> str:
+    """GA4 field name as words: screenPageViews -> screen page views."""
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", name).lower()
+
+
+def _period(value: str) -> str:
+    """Format YYYYMMDD dates as YYYY-MM-DD; other values unchanged."""
+    return f"{value[:4]}-{value[4:6]}-{value[6:]}" if re.fullmatch(r"\d{8}", value) else value
+
+
+def _range_text(date_ranges: List[tuple]) -> str:
+    return " and ".join(f"{start} to {end}" for start, end in date_ranges)
+
+
+def asks_for_analysis(query: str) -> bool:
+    """Whether the question wants more than a template renders (e.g. an average or an explanation)."""
+    return bool(_ANALYSIS_RE.search(query))
+
+
+def render_template_answer(frame: pd.DataFrame, plan: dict) -> Optional[str]:
+    """
+    Deterministic answer for simple report shapes, or None to use the summarizer.
+
+    Recognized shapes (single metric each): no dimensions (a total, per date
+    range when periods are compared), one dimension ordered with a limit (a
+    ranking), and one time dimension (a short date series).
+    """
+    metric_names = plan.get("metrics", [])
+    dimension_names = plan.get("dimensions", [])
+    if len(metric_names) != 1:
+        return None
+    metric = metric_names[0]
+    label = _label(metric)
+    date_ranges = frame.attrs.get("date_ranges", [])
+    period = f" ({_range_text(date_ranges)})" if date_ranges else ""
+
+    if not dimension_names:
+        if frame.empty:
+            return f"No {label} data was found{period}."
+        if DATE_RANGE_DIMENSION not in frame:
+            if len(date_ranges) > 1:
+                return None
+            return f"{label.capitalize()}{period}: {_format(frame[metric].iloc[0])}."
+        if len(date_ranges) != len(frame):
+            return None
+        per_range = frame.sort_values(DATE_RANGE_DIMENSION)[metric].tolist()
+        lines = [f"{label.capitalize()}:"]
+        lines += [f"- {start} to {end}: {_format(v)}" for (start, end), v in zip(date_ranges, per_range)]
+        lines += [f"Change: {_change(per_range[0], v)}" for v in per_range[1:]]
+        return "\n".join(lines)
+
+    if len(dimension_names) != 1 or DATE_RANGE_DIMENSION in frame:
+        return None
+    dimension = dimension_names[0]
+    if frame.empty:
+        return f"No {label} data was found{period}."
+
+    if dimension in TIME_DIMENSIONS:
+        series = frame.sort_values(dimension)
+        if len(series) > GA4_TEMPLATE_MAX_PERIODS:
+            return None
+        lines = [f"{label.capitalize()} by {_label(dimension)}{period}:"]
+        lines += [f"- {_period(str(d))}: {_format(v)}" for d, v in zip(series[dimension], series[metric])]
+        values = series[metric]
+        total = None if _is_ratio(metric) else _report_total(frame, metric)
+        if total is None and is_additive(metric):
+            total = values.sum()
+        if total is not None:
+            lines.append(f"Total: {_format(total)}, average per {_label(dimension)}: {_format(values.mean())}.")
+        else:
+            lines.append(f"Average: {_format(values.mean())}.")
+        return "\n".join(lines)
+
+    order_by = plan.get("order_by") or []
+    limit = plan.get("limit")
+    if not limit or len(order_by) != 1 or order_by[0]["field"] != metric:
+        return None
+    ranked = frame.sort_values(metric, ascending=not order_by[0].get("desc", True)).head(limit)
+    direction = "Top" if order_by[0].get("desc", True) else "Bottom"
+    lines = [f"{direction} {len(ranked)} by {label}, per {_label(dimension)}{period}:"]
+    lines += [f"{i}. {d}: {_format(v)}" for i, (d, v) in enumerate(zip(ranked[dimension], ranked[metric]), start=1)]
+    return "\n".join(lines)
@@ -0,0 +1,186 @@
+"""
+Per-property GA4 quota scheduling.
+
+GA4 meters every property separately (tokens per hour and per day,
+concurrent requests). Each report asks for its property quota back and the
+scheduler keeps the latest snapshot per property, admitting calls through it:
+
+- at most GA4_MAX_CONCURRENT_REQUESTS reports per property run at once, and
+  waiting interactive calls are always served before batch calls;
+- batch calls are held back while fewer than GA4_QUOTA_BATCH_RESERVE_TOKENS
+  hourly tokens are left, keeping the remainder for interactive traffic;
+- once a quota is used up, interactive calls fail fast with QuotaExhausted
+  and batch calls wait for the quota to reset, instead of each one hitting
+  the API for an opaque error.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from app import metrics, request_context
+
+logger = logging.getLogger(__name__)
+
+GA4_MAX_CONCURRENT_REQUESTS = int(os.getenv("GA4_MAX_CONCURRENT_REQUESTS", "10"))
+GA4_QUOTA_BATCH_RESERVE_TOKENS = int(os.getenv("GA4_QUOTA_BATCH_RESERVE_TOKENS", "5000"))
+
+# Hourly quotas refill on the hour; daily quotas at midnight Pacific time
+_DAILY_RESET_ZONE = ZoneInfo("America/Los_Angeles")
+_HOURLY_QUOTAS = ("tokens_per_hour", "tokens_per_project_per_hour")
+_REPORTED_QUOTAS = _HOURLY_QUOTAS + ("tokens_per_day", "concurrent_requests", "server_errors_per_project_per_hour")
+
+# Queue priorities by traffic class (lower is served first)
+_PRIORITIES = {request_context.TRAFFIC_INTERACTIVE: 0, request_context.TRAFFIC_BATCH: 1}
+
+
+class QuotaExhausted(Exception):
+    """Raised when a property's GA4 quota is used up until its next reset."""
+
+
+def _next_hour(now: float) -> float:
+    return (now // 3600 + 1) * 3600
+
+
+def _next_day(now: float) -> float:
+    local = datetime.fromtimestamp(now, _DAILY_RESET_ZONE)
+    midnight = datetime.combine(local.date() + timedelta(days=1), datetime.min.time(), _DAILY_RESET_ZONE)
+    return midnight.timestamp()
+
+
+class _PropertyState:
+    def __init__(self):
+        self.in_flight = 0
+        self.hourly_left = None  # Tokens left this hour (min over hourly quotas), None when unknown
+        self.hourly_reset = 0.0
+        self.daily_left = None
+        self.daily_reset = 0.0
+        self.waiters = []  # heap of (priority, seq, traffic, future)
+        self.timer = None
+
+    def tokens_left(self, now: float):
+        """(hourly, daily) tokens left; a snapshot taken before the last reset counts as unknown."""
+        hourly = self.hourly_left if now < self.hourly_reset else None
+        daily = self.daily_left if now < self.daily_reset else None
+        return hourly, daily
+
+
+class GA4QuotaScheduler:
+    def __init__(
+        self,
+        max_concurrent: int = GA4_MAX_CONCURRENT_REQUESTS,
+        batch_reserve_tokens: int = GA4_QUOTA_BATCH_RESERVE_TOKENS,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.batch_reserve_tokens = batch_reserve_tokens
+        self._properties = {}
+        self._seq = itertools.count()
+
+    async def acquire(self, property_id: str, traffic: str):
+        """Wait for a slot to run a report for property_id on behalf of traffic (a request_context class)."""
+        state = self._state(property_id)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(state.waiters, (_PRIORITIES.get(traffic, 0), next(self._seq), traffic, future))
+        self._dispatch(property_id)
+        if not future.done():
+            metrics.GA4_QUOTA_DELAYS.labels(traffic=traffic).inc()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Slot was granted just as we were cancelled; give it back
+                self.release(property_id)
+            raise
+
+    def release(self, property_id: str):
+        self._state(property_id).in_flight -= 1
+        self._dispatch(property_id)
+
+    def record(self, property_id: str, property_quota):
+        """Update the property's snapshot from a response's PropertyQuota."""
+        state = self._state(property_id)
+        now = time.time()
+        hourly = [getattr(property_quota, name).remaining for name in _HOURLY_QUOTAS if name in property_quota]
+        if hourly:
+            state.hourly_left, state.hourly_reset = min(hourly), _next_hour(now)
+        if "tokens_per_day" in property_quota:
+            state.daily_left, state.daily_reset = property_quota.tokens_per_day.remaining, _next_day(now)
+        for name in _REPORTED_QUOTAS:
+            if name in property_quota:
+                metrics.GA4_PROPERTY_QUOTA_REMAINING.labels(property=property_id, quota=name).set(
+                    getattr(property_quota, name).remaining
+                )
+        self._dispatch(property_id)
+
+    def mark_exhausted(self, property_id: str):
+        """Treat the property's hourly quota as used up after the API rejected a call for quota."""
+        state = self._state(property_id)
+        state.hourly_left, state.hourly_reset = 0, _next_hour(time.time())
+        logger.warning(f"GA4 quota exhausted for property {property_id} until the next hour")
+        self._dispatch(property_id)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            property_id: {
+                "in_flight": state.in_flight,
+                "queued": sum(1 for w in state.waiters if not w[3].done()),
+                "tokens_left": state.tokens_left(now),
+            }
+            for property_id, state in self._properties.items()
+        }
+
+    def _state(self, property_id: str) -> _PropertyState:
+        state = self._properties.get(property_id)
+        if state is None:
+            state = self._properties[property_id] = _PropertyState()
+        return state
+
+    def _dispatch(self, property_id: str):
+        state = self._state(property_id)
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
+
+        while state.waiters:
+            priority, seq, traffic, future = state.waiters[0]
+            if future.done():
+                heapq.heappop(state.waiters)
+                continue
+            if state.in_flight >= self.max_concurrent:
+                return  # release() re-dispatches
+
+            now = time.time()
+            hourly, daily = state.tokens_left(now)
+            if daily is not None and daily <= 0:
+                blocked_until = state.daily_reset
+            elif hourly is not None and hourly <= 0:
+                blocked_until = state.hourly_reset
+            elif traffic == request_context.TRAFFIC_BATCH and hourly is not None and hourly < self.batch_reserve_tokens:
+                blocked_until = state.hourly_reset
+            else:
+                blocked_until = None
+
+            if blocked_until is not None:
+                if traffic == request_context.TRAFFIC_INTERACTIVE:
+                    heapq.heappop(state.waiters)
+                    metrics.GA4_QUOTA_REJECTIONS.labels(traffic=traffic).inc()
+                    reset = datetime.fromtimestamp(blocked_until).astimezone().strftime("%H:%M %Z")
+                    future.set_exception(QuotaExhausted(
+                        f"GA4 quota for property {property_id} is used up; it resets at {reset}."
+                    ))
+                    continue
+                # Batch waits for the reset (or a fresher snapshot from another call)
+                state.timer = asyncio.get_running_loop().call_later(
+                    max(blocked_until - now, 0.0), self._dispatch, property_id
+                )
+                return
+
+            heapq.heappop(state.waiters)
+            state.in_flight += 1
+            future.set_result(None)
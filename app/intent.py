@@ -0,0 +1,107 @@
+"""
+Local keyword-based intent classifier.
+
+Scores a query against an analytics lexicon (GA4 metric and dimension names
+plus common traffic vocabulary) and an SEO lexicon (Screaming Frog column
+names plus common audit vocabulary). Obvious queries are routed without an
+LLM round trip; anything ambiguous falls back to the LLM classifier.
+"""
+
+import re
+from typing import Iterable, Tuple
+
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _stem(word: str) -> str:
+    """Crude plural folding so 'pages'/'page' and 'users'/'user' match."""
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: str) -> set:
+    """Lowercase word stems of free text or identifiers (camelCase aware)."""
+    text = _CAMEL_RE.sub(" ", text).lower()
+    return {_stem(w) for w in _WORD_RE.findall(text)}
+
+
+def _stems(words: Iterable[str]) -> set:
+    """Stem lexicon entries the same way as query tokens ('status' -> 'statu')."""
+    return {_stem(w) for w in words}
+
+
+# Words that always signal one side, regardless of schema overlap
+ANALYTICS_VOCABULARY = _stems({
+    "view", "pageview", "user", "visitor", "visit", "session", "traffic",
+    "bounce", "engagement", "engaged", "conversion", "revenue", "purchase",
+    "transaction", "device", "country", "city", "source", "medium", "channel",
+    "campaign", "referral", "organic", "daily", "weekly", "monthly", "trend",
+    "yesterday", "today", "day", "days", "week", "weeks", "month", "months", "year",
+    "last", "past", "previous", "ga4", "analytics",
+})
+SEO_VOCABULARY = _stems({
+    "seo", "title", "tag", "meta", "description", "h1", "h2", "canonical",
+    "indexable", "indexability", "noindex", "index", "robot", "http", "redirect",
+    "crawl", "crawled", "broken", "404", "duplicate", "alt", "inlink", "outlink",
+    "url", "status", "audit", "screaming", "frog",
+})
+# Too generic to count when they only come from field names (e.g. "Last Modified")
+STOPWORDS = _stems({
+    "a", "an", "and", "the", "of", "to", "is", "in", "on", "for", "by", "per",
+    "vs", "plus", "name", "id", "type", "count", "time", "rate", "total",
+    "average", "first", "new", "full", "list", "group", "default", "manual",
+    "string", "query", "unique", "length", "size", "1", "2", "element", "code",
+    "content", "language", "page", "item", "event", "screen", "number", "data",
+    "this", "next",
+})
+
+
+class LocalIntentClassifier:
+    def __init__(
+        self,
+        ga4_fields: Iterable[str],
+        seo_columns: Iterable[str],
+        property_weight: float = 1.0,
+    ):
+        ga4_terms = set().union(*(tokenize(f) for f in ga4_fields)) - STOPWORDS
+        seo_terms = set().union(*(tokenize(c) for c in seo_columns)) - STOPWORDS
+        # Terms derived from both schemas are ambiguous unless a vocabulary claims them
+        shared = ga4_terms & seo_terms
+        self.analytics_terms = (ga4_terms - shared) | ANALYTICS_VOCABULARY
+        self.seo_terms = (seo_terms - shared - ANALYTICS_VOCABULARY) | SEO_VOCABULARY
+        self.analytics_terms -= SEO_VOCABULARY
+        self.property_weight = property_weight
+
+    def classify(self, query: str, property_id: str = None) -> Tuple[str, float]:
+        """
+        Return (intent, confidence) with intent in ANALYTICS / SEO / BOTH.
+
+        Confidence combines how much evidence was found (number of matched
+        terms) with how clearly one side dominates; mixed signals score low
+        so they go to the LLM.
+        """
+        words = tokenize(query)
+        analytics_hits = len(words & self.analytics_terms)
+        seo_hits = len(words & self.seo_terms)
+
+        if analytics_hits and seo_hits:
+            # Both sides named explicitly: BOTH, as sure as the weaker side's evidence
+            return "BOTH", _evidence(min(analytics_hits, seo_hits)) * 0.9
+
+        # GA4 can only be queried with a propertyId, so its presence or absence leans one way
+        analytics_score = analytics_hits + (self.property_weight if property_id else 0.0)
+        seo_score = seo_hits + (0.0 if property_id else self.property_weight)
+        if analytics_hits == seo_hits == 0:
+            return "ANALYTICS" if property_id else "SEO", 0.0
+
+        total = analytics_score + seo_score
+        if analytics_score >= seo_score:
+            return "ANALYTICS", _evidence(analytics_score) * analytics_score / total
+        return "SEO", _evidence(seo_score) * seo_score / total
+
+
+def _evidence(score: float) -> float:
+    """Saturating 0..1 evidence from a match score (1 match -> 0.5, 2 -> 0.75, 3 -> 0.875)."""
+    return 1.0 - 0.5 ** score
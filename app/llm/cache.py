@@ -0,0 +1,213 @@
+"""
+Response cache for structured LLM calls.
+
+Entries are keyed on (model, normalized messages, response_model JSON schema)
+and stored as the validated model's JSON. An in-memory LRU tier is always
+used; an on-disk SQLite tier is added when LLM_CACHE_SQLITE_PATH is set so
+cached responses survive restarts and are shared between workers.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Type
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+CACHE_DEFAULT_TTL = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+CACHE_SQLITE_PATH = os.getenv("LLM_CACHE_SQLITE_PATH", "")
+CACHE_SQLITE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_SQLITE_MAX_ENTRIES", "20000"))
+
+
+def _load_schema_ttls() -> dict:
+    """Per-schema TTL overrides, e.g. '{"AnalysisSummary": 300}'. A TTL of 0 disables caching."""
+    raw = os.getenv("LLM_CACHE_SCHEMA_TTLS", "")
+    if not raw:
+        return {}
+    try:
+        return {name: float(ttl) for name, ttl in json.loads(raw).items()}
+    except (ValueError, AttributeError) as e:
+        logger.error(f"Invalid LLM_CACHE_SCHEMA_TTLS: {e}")
+        return {}
+
+
+@lru_cache(maxsize=None)
+def schema_fingerprint(response_model: Type[BaseModel]) -> str:
+    """Stable JSON form of a response model's schema (cached per class)."""
+    return json.dumps(response_model.model_json_schema(), sort_keys=True)
+
+
+def normalize_messages(messages) -> list:
+    """Collapse whitespace so indentation changes in prompt templates don't bust the cache."""
+    return [
+        {"role": m.get("role"), "content": " ".join(str(m.get("content", "")).split())}
+        for m in messages
+    ]
+
+
+def make_key(model: str, messages, response_model: Type[BaseModel]) -> str:
+    """Hash of (model, normalized messages, response schema) identifying a structured call."""
+    payload = json.dumps(
+        {
+            "model": model,
+            "messages": normalize_messages(messages),
+            "schema": schema_fingerprint(response_model),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        default_ttl: float = CACHE_DEFAULT_TTL,
+        schema_ttls: Optional[dict] = None,
+        sqlite_path: str = CACHE_SQLITE_PATH,
+        sqlite_max_entries: int = CACHE_SQLITE_MAX_ENTRIES,
+    ):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.schema_ttls = schema_ttls if schema_ttls is not None else _load_schema_ttls()
+        self.sqlite_max_entries = sqlite_max_entries
+
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._db = None
+        self._db_lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if sqlite_path:
+            self._open_sqlite(sqlite_path)
+
+    def _open_sqlite(self, path: str):
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, schema TEXT, value TEXT, "
+                "expires_at REAL, accessed_at REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+            self._db.commit()
+            logger.info(f"LLM cache: SQLite tier enabled at {path}")
+        except sqlite3.Error as e:
+            logger.error(f"LLM cache: could not open SQLite tier at {path}: {e}")
+            self._db = None
+
+    def ttl_for(self, schema_name: str) -> float:
+        return self.schema_ttls.get(schema_name, self.default_ttl)
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return the cached JSON for key, or None on a miss."""
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            del self._memory[key]
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._disk_get, key, now)
+            if row is not None:
+                expires_at, value = row
+                self._memory_set(key, value, expires_at)
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, schema_name: str, value: str):
+        ttl = self.ttl_for(schema_name)
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._memory_set(key, value, expires_at)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_set, key, schema_name, value, expires_at)
+
+    def clear(self):
+        self._memory.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM llm_cache")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+        }
+
+    def _memory_set(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_get(self, key: str, now: float):
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT expires_at, value FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[0] <= now:
+                    self._db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    return None
+                self._db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                return row
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache: SQLite read failed: {e}")
+            return None
+
+    def _disk_set(self, key: str, schema_name: str, value: str, expires_at: float):
+        now = time.time()
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, schema, value, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, schema_name, value, expires_at, now),
+                )
+                # Drop expired rows, then least-recently-used rows over the size limit
+                self._db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                cursor = self._db.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.sqlite_max_entries,),
+                )
+                self.evictions += max(cursor.rowcount, 0)
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache: SQLite write failed: {e}")
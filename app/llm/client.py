@@ -1,11 +1,24 @@
+import asyncio
+import heapq
+import itertools
 import logging
 import os
-import time
 import json
-from typing import Type, TypeVar
+import random
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from email.utils import parsedate_to_datetime
+from typing import Optional, Type, TypeVar
+import httpx
 from dotenv import load_dotenv
-from openai import OpenAI, APIError
-from pydantic import BaseModel
+from openai import AsyncOpenAI, APIError, DefaultAsyncHttpxClient
+from pydantic import BaseModel, ValidationError
+from app.llm.cache import LLMResponseCache, CACHE_ENABLED, make_key
+from app.llm.repair import StructuredOutputError, parse_structured
+from app.singleflight import SingleFlight
+from app import metrics, request_context
 
 load_dotenv()
 
@@ -13,34 +26,361 @@ logger = logging.getLogger(__name__)
 
 T = TypeVar('T', bound=BaseModel)
 
+# Connection pool for the LiteLLM proxy. Keep-alive connections are reused
+# across requests so concurrent queries don't pay a TCP/TLS handshake each.
+MAX_CONNECTIONS = int(os.getenv("LITELLM_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LITELLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("LITELLM_KEEPALIVE_EXPIRY", "30"))
+REQUEST_TIMEOUT = float(os.getenv("LITELLM_TIMEOUT", "60"))
+
+# Process-wide budget for the LiteLLM proxy, shared by every caller
+REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "300"))
+TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+# Completion tokens assumed when budgeting a request before its usage is known
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKEN_ESTIMATE", "512"))
+MAX_BACKOFF = float(os.getenv("LLM_MAX_BACKOFF_SECONDS", "30"))
+
+# Hedged requests (opt-in): if a call is slower than the given percentile of
+# recent latencies for its stage, a duplicate is sent and the first wins
+HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Hedges may be at most this fraction of primary calls (bounds extra spend)
+HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_LATENCY_WINDOW = int(os.getenv("LLM_HEDGE_LATENCY_WINDOW", "200"))
+
+# Queue priorities (lower is served first)
+PRIORITY_HIGH = 0    # Cheap routing stages: intent, decomposition
+PRIORITY_NORMAL = 1  # Planning and code generation
+PRIORITY_LOW = 2     # Large summary / fusion prompts
+
+
+def estimate_tokens(messages) -> int:
+    """Rough prompt size (~4 chars per token) plus the expected completion."""
+    chars = sum(len(str(m.get("content", ""))) for m in messages)
+    return chars // 4 + COMPLETION_TOKEN_ESTIMATE
+
+
+@lru_cache(maxsize=None)
+def _response_format(response_model: Type[BaseModel]) -> dict:
+    """JSON-schema response_format for a response model (cached per class)."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_model.__name__,
+            "schema": response_model.model_json_schema(),
+        },
+    }
+
+
+def _retry_after_seconds(error: APIError) -> Optional[float]:
+    """Read Retry-After (seconds or HTTP date) from a 429 response, if present."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Continuously refilling budget of `per_minute` units."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (requests larger than the bucket wait for a full one)."""
+        self._refill(now)
+        needed = min(amount, self.capacity) - self.tokens
+        return needed / self.rate if needed > 0 else 0.0
+
+    def consume(self, amount: float):
+        # May go negative: actual usage reported after a call is charged as debt
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """
+    Shared limiter in front of the LiteLLM proxy.
+
+    Combines requests/min and tokens/min token buckets with an adaptive (AIMD)
+    concurrency cap: the cap halves on every 429 and grows by ~1 per window of
+    successes. A Retry-After from the proxy pauses dispatch for everyone.
+    Waiters are served from a priority queue, so cheap routing calls are not
+    stuck behind large summary prompts.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = TOKENS_PER_MINUTE,
+        max_concurrency: int = MAX_CONCURRENCY,
+        min_concurrency: int = MIN_CONCURRENCY,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = max(1, min_concurrency)
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.rate_limited = 0
+
+        self._waiters = []  # heap of (priority, seq, tokens, future)
+        self._seq = itertools.count()
+        self._timer = None
+
+    @asynccontextmanager
+    async def slot(self, tokens: int, priority: int = PRIORITY_NORMAL):
+        """Wait for budget and a concurrency slot, holding the slot for the block."""
+        await self.acquire(tokens, priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, tokens: int, priority: int = PRIORITY_NORMAL):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), tokens, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted just as we were cancelled; give it back
+                self.release()
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._dispatch()
+
+    def on_success(self):
+        self.concurrency_limit = min(
+            self.max_concurrency, self.concurrency_limit + 1.0 / self.concurrency_limit
+        )
+
+    def on_rate_limited(self, retry_after: Optional[float] = None):
+        self.rate_limited += 1
+        self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+        if retry_after:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        logger.warning(
+            f"LLM rate limited: concurrency cap now {int(self.concurrency_limit)}"
+            + (f", pausing {retry_after:.1f}s" if retry_after else "")
+        )
+
+    def charge(self, tokens: int):
+        """Adjust the token budget once a call's actual usage is known."""
+        self.tokens.consume(tokens)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": sum(1 for w in self._waiters if not w[3].done()),
+            "concurrency_limit": int(self.concurrency_limit),
+            "rate_limited": self.rate_limited,
+        }
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._waiters:
+            priority, seq, tokens, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= int(self.concurrency_limit):
+                return  # release() re-dispatches
+
+            now = time.monotonic()
+            wait = max(
+                self.paused_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(tokens, now),
+            )
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            heapq.heappop(self._waiters)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+
+class Hedger:
+    """
+    Tracks recent latency per key (stage) and duplicates slow calls.
+
+    A hedge fires when the primary call has not finished within the
+    configured percentile of recent latencies and the hedge budget
+    (max_ratio of primary calls) allows it. The first successful call wins
+    and the other is cancelled.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = HEDGE_ENABLED,
+        percentile: float = HEDGE_PERCENTILE,
+        max_ratio: float = HEDGE_MAX_RATIO,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+        window: int = HEDGE_LATENCY_WINDOW,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.max_ratio = max_ratio
+        self.min_samples = min_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def observe(self, key: str, seconds: float):
+        self._latencies[key].append(seconds)
+
+    def delay_for(self, key: str) -> Optional[float]:
+        """Hedge delay for key, or None until enough latency samples exist."""
+        samples = self._latencies.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return ordered[index]
+
+    def _within_budget(self) -> bool:
+        return self.hedges < self.max_ratio * self.calls
+
+    async def run(self, key: str, attempt):
+        """Run attempt(), hedging it with a second attempt() if it is slow."""
+        self.calls += 1
+        delay = self.delay_for(key) if self.enabled else None
+        if delay is None:
+            return await attempt()
+
+        primary = asyncio.ensure_future(attempt())
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done or not self._within_budget():
+                return await primary
+
+            self.hedges += 1
+            logger.debug(f"Hedging slow '{key}' call after {delay:.2f}s")
+            hedge = asyncio.ensure_future(attempt())
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+            # Both attempts failed; surface the primary's error
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
 
 class LiteLLMClient:
     def __init__(self):
         self.api_key = os.getenv("LITELLM_API_KEY")
         if not self.api_key:
             raise ValueError("LITELLM_API_KEY environment variable not set")
-            
+
         self.base_url = os.getenv("LITELLM_BASE_URL", "http://3.110.18.218")
-        self.client = OpenAI(
+        self.client = AsyncOpenAI(
             api_key=self.api_key,
-            base_url=self.base_url
+            base_url=self.base_url,
+            timeout=REQUEST_TIMEOUT,
+            # Retries (and 429 backoff) are handled below
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                )
+            ),
         )
+        self.cache = LLMResponseCache() if CACHE_ENABLED else None
+        self.limiter = RateLimiter()
+        self.inflight = SingleFlight("llm")
+        self.hedger = Hedger()
+        # Per-schema structured output outcomes: parsed / repaired / reissued / failed
+        self.structured_stats = defaultdict(Counter)
+
+    async def aclose(self):
+        """Close pooled connections to the proxy."""
+        await self.client.close()
+
+    def stats(self) -> dict:
+        """Snapshot of cache, limiter, coalescing, hedging and structured-output counters."""
+        return {
+            "cache": self.cache.stats() if self.cache else None,
+            "limiter": self.limiter.stats(),
+            "inflight": self.inflight.stats(),
+            "hedging": self.hedger.stats(),
+            "structured": {schema: dict(counts) for schema, counts in self.structured_stats.items()},
+        }
 
-    def chat(self, messages, model="gemini-2.5-flash", max_retries=5):
+    async def chat(self, messages, model="gemini-2.5-flash", max_retries=5, priority=PRIORITY_NORMAL, stage="chat"):
         """Standard chat completion - returns raw text."""
-        base_delay = 1
+        with metrics.LLM_STAGE_LATENCY.labels(stage).time():
+            return await request_context.within_deadline(self._chat(messages, model, max_retries, priority, stage))
+
+    async def _chat(self, messages, model, max_retries, priority, stage):
         for attempt in range(max_retries):
+            if attempt:
+                metrics.LLM_RETRIES.labels(stage).inc()
             try:
-                response = self.client.chat.completions.create(
+                response = await self._create(
+                    self.client.chat.completions.create,
+                    priority,
+                    stage,
                     model=model,
                     messages=messages
                 )
                 return response.choices[0].message.content
             except APIError as e:
-                if e.status_code == 429:
-                    wait_time = base_delay * (2 ** attempt)
-                    logger.warning(f"Rate limited. Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
+                if getattr(e, "status_code", None) == 429:
+                    await self._backoff(e, attempt, stage)
                 else:
                     raise e
             except Exception as e:
@@ -48,54 +388,184 @@ class LiteLLMClient:
                 raise e
         raise Exception("Max retries exceeded")
 
-    def chat_structured(
+    async def chat_stream(self, messages, model="gemini-2.5-flash", max_retries=5, priority=PRIORITY_LOW, stage="chat"):
+        """Streaming chat completion - yields text deltas as the proxy produces them."""
+        estimate = estimate_tokens(messages)
+        started = False
+        with metrics.LLM_STAGE_LATENCY.labels(stage).time():
+            for attempt in range(max_retries):
+                if attempt:
+                    metrics.LLM_RETRIES.labels(stage).inc()
+                try:
+                    async with self.limiter.slot(estimate, priority):
+                        request_context.check_deadline()
+                        start = time.monotonic()
+                        stream = await self.client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            stream=True,
+                            stream_options={"include_usage": True},
+                            **self._timeout_kwargs()
+                        )
+                        async for chunk in stream:
+                            request_context.check_deadline()
+                            if chunk.usage is not None:
+                                metrics.LLM_TOKENS.labels(stage, "prompt").inc(chunk.usage.prompt_tokens or 0)
+                                metrics.LLM_TOKENS.labels(stage, "completion").inc(chunk.usage.completion_tokens or 0)
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                started = True
+                                yield chunk.choices[0].delta.content
+                        metrics.LLM_REQUEST_LATENCY.labels(stage).observe(time.monotonic() - start)
+                    self.limiter.on_success()
+                    return
+                except APIError as e:
+                    # Output already sent can't be taken back, so only retry before the first token
+                    if getattr(e, "status_code", None) == 429 and not started:
+                        await self._backoff(e, attempt, stage)
+                    else:
+                        raise e
+            raise Exception("Max retries exceeded")
+
+    def _timeout_kwargs(self) -> dict:
+        """Per-request timeout capped at the remaining request budget."""
+        left = request_context.remaining()
+        return {} if left is None else {"timeout": max(min(left, REQUEST_TIMEOUT), 0.001)}
+
+    async def _create(self, create, priority, stage, **kwargs):
+        """Issue one completion request through the shared rate limiter, hedged if slow."""
+        estimate = estimate_tokens(kwargs["messages"])
+
+        async def attempt():
+            async with self.limiter.slot(estimate, priority):
+                request_context.check_deadline()
+                start = time.monotonic()
+                try:
+                    response = await create(**kwargs, **self._timeout_kwargs())
+                except asyncio.CancelledError:
+                    # A cancelled hedge loser still gives a lower bound on latency
+                    self.hedger.observe(stage, time.monotonic() - start)
+                    raise
+                elapsed = time.monotonic() - start
+                self.hedger.observe(stage, elapsed)
+                metrics.LLM_REQUEST_LATENCY.labels(stage).observe(elapsed)
+            self.limiter.on_success()
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                metrics.LLM_TOKENS.labels(stage, "prompt").inc(usage.prompt_tokens or 0)
+                metrics.LLM_TOKENS.labels(stage, "completion").inc(usage.completion_tokens or 0)
+                if usage.total_tokens:
+                    self.limiter.charge(usage.total_tokens - estimate)
+            return response
+
+        return await self.hedger.run(stage, attempt)
+
+    async def _backoff(self, error: APIError, attempt: int, stage: str):
+        """Handle a 429: honor Retry-After globally, otherwise back off with full jitter."""
+        metrics.LLM_RATE_LIMITED.labels(stage).inc()
+        retry_after = _retry_after_seconds(error)
+        self.limiter.on_rate_limited(retry_after)
+        left = request_context.remaining()
+        if left is not None and (retry_after or 0) >= left:
+            raise request_context.DeadlineExceeded("rate limited past the request deadline")
+        if retry_after is None:
+            wait_time = random.uniform(0, min(MAX_BACKOFF, 2 ** attempt))
+            if left is not None and wait_time >= left:
+                raise request_context.DeadlineExceeded("rate limited past the request deadline")
+            logger.warning(f"Rate limited. Retrying in {wait_time:.1f}s...")
+            await asyncio.sleep(wait_time)
+        # With Retry-After the limiter holds every caller until the pause ends
+
+    async def chat_structured(
         self,
         messages,
         response_model: Type[T],
         model="gemini-2.5-flash",
-        max_retries=5
+        max_retries=5,
+        use_cache=True,
+        priority=PRIORITY_NORMAL,
+        stage=None
     ) -> T:
         """
         Structured chat completion with JSON schema enforcement.
         Returns a validated Pydantic model instance.
-        
+
         Args:
             messages: List of message dicts with 'role' and 'content'
             response_model: Pydantic model class defining the expected response structure
             model: LLM model to use
             max_retries: Number of retry attempts for rate limiting
-            
+            use_cache: Serve from / store into the response cache when enabled
+            priority: Queue priority in the shared rate limiter (PRIORITY_*)
+            stage: Pipeline stage for telemetry and hedging (metrics.STAGE_*); defaults to the schema name
+
         Returns:
             Instance of response_model with validated data
         """
-        base_delay = 1
-        
+        stage = stage or response_model.__name__
+        with metrics.LLM_STAGE_LATENCY.labels(stage).time():
+            key = make_key(model, messages, response_model)
+            use_cache = use_cache and self.cache is not None
+
+            if use_cache:
+                cached = await self.cache.get(key)
+                metrics.LLM_CACHE_REQUESTS.labels(stage, "miss" if cached is None else "hit").inc()
+                if cached is not None:
+                    try:
+                        return response_model.model_validate_json(cached)
+                    except ValidationError:
+                        logger.warning(f"Discarding stale cache entry for {response_model.__name__}")
+
+            async def fetch(budget):
+                # Timeouts, retries and backoff inside read the shared budget through request_context
+                result = await self._complete_structured(messages, response_model, model, max_retries, priority, stage)
+                if use_cache:
+                    await self.cache.set(key, response_model.__name__, result.model_dump_json())
+                return result
+
+            # Identical concurrent calls share one request; the result is shared, treat it as read-only.
+            # Queueing, retries and backoff all count against the request deadline.
+            return await request_context.within_deadline(self.inflight.do((key, use_cache), fetch))
+
+    async def _complete_structured(self, messages, response_model: Type[T], model, max_retries, priority, stage) -> T:
+        schema = response_model.__name__
         for attempt in range(max_retries):
+            if attempt:
+                metrics.LLM_RETRIES.labels(stage).inc()
             try:
-                # Use the beta parse method which handles schema generation and validation
-                response = self.client.beta.chat.completions.parse(
+                response = await self._create(
+                    self.client.chat.completions.create,
+                    priority,
+                    stage,
                     model=model,
                     messages=messages,
-                    response_format=response_model
+                    response_format=_response_format(response_model)
                 )
-                
-                parsed_response = response.choices[0].message.parsed
-                
-                if parsed_response:
-                    return parsed_response
-                elif response.choices[0].message.refusal:
-                    logger.warning(f"Model refused to generate structured output: {response.choices[0].message.refusal}")
-                    raise ValueError(f"Model refused request: {response.choices[0].message.refusal}")
-                else:
-                    raise ValueError("Model returned response but parsing failed.")
-                
+
+                message = response.choices[0].message
+                if getattr(message, "refusal", None):
+                    logger.warning(f"Model refused to generate structured output: {message.refusal}")
+                    raise ValueError(f"Model refused request: {message.refusal}")
+
+                # Validate locally, repairing near-miss JSON before paying for a re-issue
+                try:
+                    parsed_response, repaired = parse_structured(message.content, response_model)
+                except StructuredOutputError as e:
+                    outcome = "reissued" if attempt < max_retries - 1 else "failed"
+                    self.structured_stats[schema][outcome] += 1
+                    raise ValueError(f"Model returned response but parsing failed: {e}")
+
+                self.structured_stats[schema]["repaired" if repaired else "parsed"] += 1
+                if repaired:
+                    logger.debug(f"Repaired {schema} output locally")
+                return parsed_response
+
             except APIError as e:
-                if e.status_code == 429:
-                    wait_time = base_delay * (2 ** attempt)
-                    logger.warning(f"Rate limited. Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
+                if getattr(e, "status_code", None) == 429:
+                    await self._backoff(e, attempt, stage)
                 else:
                     raise e
+            except request_context.DeadlineExceeded:
+                raise
             except Exception as e:
                 logger.error(f"Unexpected error: {e}")
                 # If it's the last attempt, re-raise
@@ -105,3 +575,4 @@ class LiteLLMClient:
 
 
 llm_client = LiteLLMClient()
+metrics.register_llm_client(llm_client)
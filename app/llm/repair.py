@@ -0,0 +1,242 @@
+"""
+Local repair of structured LLM outputs.
+
+Models often return almost-valid JSON: wrapped in markdown fences, followed
+by an explanation, with trailing commas or Python literals, or using a
+different field name. Fixing those locally is much cheaper than re-sending
+the whole prompt, so the client only re-issues a call when the output
+cannot be repaired here.
+"""
+
+import ast
+import json
+import re
+import typing
+from typing import Any, Tuple, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from app.llm.schemas import PLAIN_TEXT_FIELDS, apply_field_aliases
+
+T = TypeVar('T', bound=BaseModel)
+
+_FENCE_RE = re.compile(r"```[a-zA-Z0-9_+-]*\s*\n?(.*?)```", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a completion cannot be turned into the response model locally."""
+
+
+def strip_fences(text: str) -> str:
+    """Return the contents of the first markdown code fence, or the text unchanged."""
+    match = _FENCE_RE.search(text)
+    return match.group(1).strip() if match else text.strip()
+
+
+def extract_json_block(text: str) -> str:
+    """
+    Cut the first balanced {...} or [...] out of text, dropping leading and
+    trailing prose. Returns the text unchanged if no opening bracket exists.
+    """
+    return _json_block(text)[0]
+
+
+def _json_block(text: str) -> Tuple[str, bool]:
+    """extract_json_block() plus whether unclosed brackets (truncated output) had to be closed."""
+    start = next((i for i, ch in enumerate(text) if ch in "{["), None)
+    if start is None:
+        return text, False
+
+    stack = []
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack or stack.pop() != ch:
+                break
+            if not stack:
+                return text[start:i + 1], False
+
+    # Unbalanced (e.g. truncated output): close whatever is still open
+    if in_string:
+        text = text + '"'
+    return text[start:] + "".join(reversed(stack)), bool(stack) or in_string
+
+
+def _replace_python_literals(text: str) -> str:
+    """Swap True/False/None for JSON literals outside of string values."""
+    out = []
+    in_string = False
+    escaped = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            i += 1
+            continue
+        if ch == '"':
+            in_string = True
+            out.append(ch)
+            i += 1
+            continue
+        for literal, replacement in _PY_LITERALS.items():
+            if text.startswith(literal, i) and not (i and text[i - 1].isalnum()):
+                end = i + len(literal)
+                if end == len(text) or not text[end].isalnum():
+                    out.append(replacement)
+                    i = end
+                    break
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def _loads_lenient(text: str) -> Tuple[Any, bool]:
+    """
+    json.loads with fixes for common defects, falling back to Python literal syntax.
+
+    Returns (data, truncated) where truncated is True if unclosed brackets were closed.
+    """
+    candidate, truncated = _json_block(strip_fences(text.translate(_SMART_QUOTES)))
+    candidate = _TRAILING_COMMA_RE.sub(r"\1", candidate)
+    try:
+        return json.loads(candidate), truncated
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.loads(_replace_python_literals(candidate)), truncated
+    except json.JSONDecodeError:
+        pass
+    try:
+        # Single-quoted keys/strings, Python-style dicts
+        return ast.literal_eval(candidate), truncated
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise StructuredOutputError("no parseable JSON in model output")
+
+
+def _nested_models(annotation: Any):
+    """Yield BaseModel classes referenced by a field annotation (List[X], Optional[X], ...)."""
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        yield annotation
+        return
+    for arg in typing.get_args(annotation):
+        yield from _nested_models(arg)
+
+
+def apply_aliases(data: Any, response_model: Type[BaseModel]) -> Any:
+    """Apply FIELD_ALIASES to data and, recursively, to nested model fields."""
+    data = apply_field_aliases(response_model.__name__, data)
+    if not isinstance(data, dict):
+        return data
+
+    data = dict(data)
+    for name, field in response_model.model_fields.items():
+        if name not in data:
+            continue
+        for nested in _nested_models(field.annotation):
+            value = data[name]
+            if isinstance(value, list):
+                data[name] = [apply_aliases(v, nested) for v in value]
+            else:
+                data[name] = apply_aliases(value, nested)
+    return data
+
+
+def _coerce_shape(data: Any, response_model: Type[BaseModel]) -> Any:
+    """Unwrap {"Schema": {...}} / [{...}] envelopes."""
+    fields = response_model.model_fields
+    if isinstance(data, list) and len(data) == 1 and isinstance(data[0], dict):
+        data = data[0]
+    if isinstance(data, dict) and len(data) == 1:
+        (key, inner), = data.items()
+        if key not in fields and isinstance(inner, dict):
+            data = inner
+    return data
+
+
+def _has_object(data: Any) -> bool:
+    return isinstance(data, dict) or (isinstance(data, list) and any(isinstance(v, dict) for v in data))
+
+
+def _plain_text(content: str, field: str) -> Any:
+    """Bare text as {field: text}, or None when it cannot be that field (code that does not compile)."""
+    text = strip_fences(content)
+    if field == "code":
+        try:
+            compile(text, "<structured_output>", "exec")
+        except (SyntaxError, ValueError):
+            return None
+    return {field: text}
+
+
+def parse_structured(content: str, response_model: Type[T]) -> Tuple[T, bool]:
+    """
+    Validate model output against response_model, repairing it locally if needed.
+
+    Returns:
+        (instance, repaired) where repaired is True if the raw content was not valid as-is
+
+    Raises:
+        StructuredOutputError: if the output cannot be repaired
+    """
+    if not content:
+        raise StructuredOutputError("empty model output")
+
+    try:
+        return response_model.model_validate_json(content), False
+    except ValidationError:
+        pass
+
+    name = response_model.__name__
+    candidates = []
+    data = None
+    try:
+        data, truncated = _loads_lenient(content)
+    except StructuredOutputError:
+        pass
+    else:
+        # Closing truncated output would accept an answer the model never finished; re-issue instead
+        if truncated:
+            raise StructuredOutputError(f"{name} output is truncated")
+        candidates.append(data)
+    # Plain-text answer (bare code or a bare label), only when the output holds no JSON object
+    if name in PLAIN_TEXT_FIELDS and not _has_object(data):
+        plain = _plain_text(content, PLAIN_TEXT_FIELDS[name])
+        if plain is not None:
+            candidates.append(plain)
+
+    error = None
+    for data in candidates:
+        data = apply_aliases(_coerce_shape(data, response_model), response_model)
+        try:
+            return response_model.model_validate(data), True
+        except ValidationError as e:
+            error = error or e
+    if error is None:
+        raise StructuredOutputError(f"output cannot be repaired into {name}")
+    raise StructuredOutputError(
+        f"output does not match {name}: {error.error_count()} validation error(s)"
+    ) from error
@@ -7,6 +7,30 @@ from pydantic import BaseModel, Field, field_validator, model_validator
 from typing import Literal, List, Optional, Any
 
 
+# Alternate field names the LLM sometimes returns, per schema (alias -> field).
+# Applied by the schemas themselves and by the structured-output repair stage.
+FIELD_ALIASES = {
+    "OrderByField": {"field_name": "field"},
+    "SEOCodeResponse": {"result": "code", "answer": "code"},
+}
+
+# One-field schemas whose value may come back as bare text instead of JSON (a label or code).
+PLAIN_TEXT_FIELDS = {
+    "IntentClassification": "intent",
+    "SEOCodeResponse": "code",
+}
+
+
+def apply_field_aliases(schema_name: str, data: Any) -> Any:
+    """Rename known alias keys to their schema field names (first alias wins)."""
+    if isinstance(data, dict):
+        for alias, field in FIELD_ALIASES.get(schema_name, {}).items():
+            if alias in data and field not in data:
+                data = dict(data)
+                data[field] = data.pop(alias)
+    return data
+
+
 # ============== Orchestrator Schemas ==============
 
 class IntentClassification(BaseModel):
@@ -32,6 +56,10 @@ class DecomposedQuery(BaseModel):
         default=10,
         description="Number of results requested (default: 10)"
     )
+    seo_filter: bool = Field(
+        default=False,
+        description="True if the SEO part restricts which pages qualify (e.g. only non-indexable pages), False if it only adds page attributes"
+    )
 
 
 class MultiAgentResponse(BaseModel):
@@ -63,12 +91,12 @@ class OrderByField(BaseModel):
     def normalize_field_name(cls, v: Any, info) -> str:
         """Accept 'field' directly if provided."""
         return v
-    
-    def __init__(self, **data):
-        # Handle 'field_name' as an alias for 'field'
-        if 'field_name' in data and 'field' not in data:
-            data['field'] = data.pop('field_name')
-        super().__init__(**data)
+
+    @model_validator(mode='before')
+    @classmethod
+    def map_field_name(cls, data: Any) -> Any:
+        # Handle 'field_name' as an alias for 'field' (also when nested in GA4QueryPlan)
+        return apply_field_aliases(cls.__name__, data)
 
 
 class GA4QueryPlan(BaseModel):
@@ -87,6 +115,17 @@ class GA4QueryPlan(BaseModel):
         default=None,
         description="Optional ordering specification"
     )
+    limit: Optional[int] = Field(
+        default=None,
+        description="Maximum number of rows, for 'top N' questions"
+    )
+
+
+class GA4ReportPlans(BaseModel):
+    """Response schema for GA4 planning of questions that may need several reports."""
+    plans: List[GA4QueryPlan] = Field(
+        description="One plan per separate report needed (e.g. one per breakdown); usually a single plan"
+    )
 
 
 class AnalysisSummary(BaseModel):
@@ -100,6 +139,16 @@ class AnalysisSummary(BaseModel):
     )
 
 
+# ============== Planner Schemas ==============
+
+class QueryPlan(IntentClassification, DecomposedQuery):
+    """Response schema for the unified planner: routing, decomposition and GA4 plan in one call."""
+    ga4_plans: List[GA4QueryPlan] = Field(
+        default=[],
+        description="GA4 query plans (one per separate report) for the analytics part of the query; empty when no GA4 data is needed"
+    )
+
+
 # ============== SEO Agent Schemas ==============
 
 class SEOCodeResponse(BaseModel):
@@ -111,11 +160,5 @@ class SEOCodeResponse(BaseModel):
     @model_validator(mode='before')
     @classmethod
     def map_result_to_code(cls, data: Any) -> Any:
-        if isinstance(data, dict):
-            # Check for 'result' fallback
-            if 'result' in data and 'code' not in data:
-                data['code'] = data.pop('result')
-            # Check for 'answer' fallback
-            elif 'answer' in data and 'code' not in data:
-                data['code'] = data.pop('answer')
-        return data
+        # Accept 'result' or 'answer' in place of 'code'
+        return apply_field_aliases(cls.__name__, data)
@@ -0,0 +1,186 @@
+"""
+Prometheus metrics for the query pipeline, served on GET /metrics.
+
+Hot-path metrics (latencies, tokens, retries, cache lookups) are plain
+prometheus_client counters and histograms. Counters that components already
+keep for themselves (limiter, hedging, coalescing, structured-output repair)
+are read only when /metrics is scraped, so they add nothing per request.
+"""
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Pipeline stages that call the LLM
+STAGE_INTENT = "intent"
+STAGE_PLAN = "plan"
+STAGE_DECOMPOSE = "decompose"
+STAGE_GA4_PLAN = "ga4_plan"
+STAGE_GA4_SUMMARY = "ga4_summary"
+STAGE_SEO_CODEGEN = "seo_codegen"
+STAGE_FUSION = "fusion"
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+
+LLM_STAGE_LATENCY = Histogram(
+    "llm_stage_duration_seconds",
+    "End-to-end LLM call latency per stage, including cache, queueing and retries",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_REQUEST_LATENCY = Histogram(
+    "llm_request_duration_seconds",
+    "Latency of individual completion requests to the LiteLLM proxy",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens reported in response.usage",
+    ["stage", "kind"],
+)
+LLM_RETRIES = Counter(
+    "llm_retries_total",
+    "Completion attempts beyond the first",
+    ["stage"],
+)
+LLM_RATE_LIMITED = Counter(
+    "llm_rate_limited_total",
+    "429 responses from the LiteLLM proxy",
+    ["stage"],
+)
+LLM_CACHE_REQUESTS = Counter(
+    "llm_cache_requests_total",
+    "Structured response cache lookups",
+    ["stage", "result"],
+)
+
+INTENT_DECISIONS = Counter(
+    "intent_decisions_total",
+    "Routing decisions by classifier (local fast path or LLM)",
+    ["source"],
+)
+INTENT_SHADOW_COMPARISONS = Counter(
+    "intent_shadow_comparisons_total",
+    "Shadow-mode comparisons of confident local classifications against the LLM",
+    ["result"],
+)
+ANSWER_CACHE_REQUESTS = Counter(
+    "answer_cache_requests_total",
+    "Orchestrator answer cache lookups",
+    ["result"],
+)
+PLAN_CACHE_REQUESTS = Counter(
+    "plan_cache_requests_total",
+    "Memoized GA4 plan / SEO code lookups",
+    ["kind", "result"],
+)
+GA4_SPECULATIONS = Counter(
+    "ga4_speculations_total",
+    "Speculative GA4 planning outcomes (hit: routing needed GA4, miss: discarded)",
+    ["result"],
+)
+GA4_SPECULATION_WASTED = Counter(
+    "ga4_speculative_calls_wasted_total",
+    "Calls started by discarded GA4 speculation",
+    ["call"],
+)
+GA4_REPORT_CACHE_REQUESTS = Counter(
+    "ga4_report_cache_requests_total",
+    "GA4 report cache lookups",
+    ["result"],
+)
+GA4_REPORT_CACHE_BYTES = Gauge(
+    "ga4_report_cache_bytes",
+    "Serialized size of the GA4 reports held in the report cache",
+)
+GA4_PROPERTY_QUOTA_REMAINING = Gauge(
+    "ga4_property_quota_remaining",
+    "GA4 quota left per property as of the latest report",
+    ["property", "quota"],
+)
+GA4_QUOTA_DELAYS = Counter(
+    "ga4_quota_delays_total",
+    "GA4 reports that had to wait for a per-property slot or quota",
+    ["traffic"],
+)
+GA4_QUOTA_REJECTIONS = Counter(
+    "ga4_quota_rejections_total",
+    "GA4 reports refused locally because the property quota was used up",
+    ["traffic"],
+)
+GA4_API_CALLS = Counter(
+    "ga4_api_calls_total",
+    "GA4 Data API calls by method",
+    ["method"],
+)
+GA4_BATCHED_REPORTS = Counter(
+    "ga4_reports_fetched_total",
+    "Reports fetched from the GA4 Data API (several per batch_run_reports call)",
+)
+GA4_ANSWERS = Counter(
+    "ga4_answers_total",
+    "GA4 answers by how they were written (template: locally, llm: summary call)",
+    ["source"],
+)
+
+GA4_REPORT_LATENCY = Histogram(
+    "ga4_run_report_duration_seconds",
+    "GA4 Data API call latency (run_report / batch_run_reports)",
+    buckets=_LATENCY_BUCKETS,
+)
+SEO_EXEC_LATENCY = Histogram(
+    "seo_exec_duration_seconds",
+    "Execution time of generated SEO analysis code",
+    buckets=_LATENCY_BUCKETS,
+)
+
+
+class LLMClientCollector:
+    """Exposes LiteLLMClient.stats() at scrape time."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def collect(self):
+        stats = self.client.stats()
+
+        limiter = stats["limiter"]
+        for name in ("in_flight", "queued", "concurrency_limit"):
+            gauge = GaugeMetricFamily(f"llm_limiter_{name}", f"LLM rate limiter {name.replace('_', ' ')}")
+            gauge.add_metric([], limiter[name])
+            yield gauge
+
+        hedging = stats["hedging"]
+        hedges = CounterMetricFamily("llm_hedges", "Hedged LLM requests", labels=["result"])
+        hedges.add_metric(["won"], hedging["hedge_wins"])
+        hedges.add_metric(["lost"], hedging["hedges"] - hedging["hedge_wins"])
+        yield hedges
+
+        coalesced = CounterMetricFamily("llm_coalesced_calls", "LLM calls that joined an identical in-flight call")
+        coalesced.add_metric([], stats["inflight"]["coalesced"])
+        yield coalesced
+
+        structured = CounterMetricFamily(
+            "llm_structured_outputs", "Structured output outcomes per schema", labels=["schema", "outcome"]
+        )
+        for schema, outcomes in stats["structured"].items():
+            for outcome, count in outcomes.items():
+                structured.add_metric([schema, outcome], count)
+        yield structured
+
+        cache = stats["cache"]
+        if cache:
+            entries = GaugeMetricFamily("llm_cache_memory_entries", "Entries in the in-memory LLM cache")
+            entries.add_metric([], cache["memory_entries"])
+            yield entries
+            evictions = CounterMetricFamily("llm_cache_evictions", "LLM cache evictions")
+            evictions.add_metric([], cache["evictions"])
+            yield evictions
+
+
+def register_llm_client(client):
+    REGISTRY.register(LLMClientCollector(client))
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
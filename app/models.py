@@ -1,10 +1,38 @@
-
-from pydantic import BaseModel
-from typing import Optional
+import pandas as pd
+from pydantic import BaseModel, ConfigDict, Field
+from typing import List, Optional
 
 class QueryRequest(BaseModel):
     query: str
     propertyId: Optional[str] = None
+    # Answer cache controls (also set by a Cache-Control: no-cache / no-store header)
+    no_cache: bool = False
+    no_store: bool = False
+    # End-to-end time budget in seconds (also set by an X-Request-Timeout header)
+    timeout_seconds: Optional[float] = Field(default=None, gt=0)
 
 class QueryResponse(BaseModel):
     answer: str
+    # True when a stage failed or ran out of time and the answer is the best partial one
+    partial: bool = False
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+    # Stream results as NDJSON lines in completion order instead of one JSON response
+    stream: bool = False
+
+class BatchItemResult(BaseModel):
+    index: int
+    answer: Optional[str] = None
+    error: Optional[str] = None
+    partial: bool = False
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchItemResult]
+
+class AgentResult(BaseModel):
+    """An agent's answer text plus, when available, the table it was computed from."""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    text: str
+    frame: Optional[pd.DataFrame] = None
@@ -1,49 +1,352 @@
+import asyncio
 import logging
 import json
+import os
 import re
-from urllib.parse import urlparse
+from typing import List, Optional, Tuple
 
-from app.models import QueryRequest
-from app.agents.analytics import analytics_agent
+from app.models import QueryRequest, AgentResult
+from app.agents.analytics import analytics_agent, property_today, ALLOWED_METRICS, ALLOWED_DIMENSIONS, GA4_PLAN_GUIDE
 from app.agents.seo import seo_agent
-from app.llm.client import llm_client
-from app.llm.schemas import IntentClassification, DecomposedQuery, MultiAgentResponse
+from app.llm.client import llm_client, PRIORITY_HIGH, PRIORITY_LOW
+from app.llm.schemas import IntentClassification, DecomposedQuery, MultiAgentResponse, QueryPlan
+from app.intent import LocalIntentClassifier
+from app.answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+from app import answer_cache, fusion, metrics, request_context
 
 logger = logging.getLogger(__name__)
 
+# Local intent classification: skip the LLM when the keyword classifier is confident enough
+INTENT_FAST_PATH_ENABLED = os.getenv("INTENT_FAST_PATH_ENABLED", "true").lower() == "true"
+INTENT_FAST_PATH_THRESHOLD = float(os.getenv("INTENT_FAST_PATH_THRESHOLD", "0.8"))
+# Shadow mode always routes on the LLM and only records whether the fast path would have agreed
+INTENT_SHADOW_MODE = os.getenv("INTENT_SHADOW_MODE", "false").lower() == "true"
+# Speculative GA4 planning (and optionally run_report) while intent is classified
+GA4_SPECULATION_ENABLED = os.getenv("GA4_SPECULATION_ENABLED", "false").lower() == "true"
+GA4_SPECULATIVE_REPORT = os.getenv("GA4_SPECULATIVE_REPORT", "false").lower() == "true"
+# One planner call for intent, decomposition and GA4 plan (falls back to separate calls on failure)
+UNIFIED_PLANNER_ENABLED = os.getenv("UNIFIED_PLANNER_ENABLED", "true").lower() == "true"
+# Default end-to-end budget per request (0 disables); a request may ask for its own
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "90"))
+# Extra time past the deadline for stages to hand back partial answers
+DEADLINE_GRACE_SECONDS = 1.0
+# Concurrent requests per /query/batch call
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+# Per-branch timeout for multi-agent queries; a slow branch is dropped and fusion uses the other
+BRANCH_TIMEOUT_SECONDS = float(os.getenv("MULTI_AGENT_BRANCH_TIMEOUT_SECONDS", "60"))
+
+# Plan value when the unified planner was called and failed, so later stages don't call it again
+PLANNER_FAILED = object()
+
 class Orchestrator:
     def __init__(self):
-        pass
+        self._intent_classifier = None
+        self._intent_columns = None
+        self.answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+        self._answer_cache_seo_version = None
 
     async def route_request(self, request: QueryRequest):
+        """
+        Answer a request within its deadline, from the answer cache when possible.
+
+        The deadline (request.timeout_seconds, else REQUEST_DEADLINE_SECONDS)
+        applies to every stage; stages that run out of time degrade to the
+        best partial answer available.
+        """
+        with request_context.deadline(request.timeout_seconds or REQUEST_DEADLINE_SECONDS):
+            return await self._answer(request)
+
+    async def _answer(self, request: QueryRequest):
+        """
+        Serve from the answer cache, or route and cache the result.
+
+        request.no_cache skips the lookup (the fresh answer is still stored);
+        request.no_store keeps the answer out of the cache. Degraded answers
+        (agent errors, fallbacks, partial answers) are never stored.
+        """
+        if self.answer_cache is None:
+            return await self._route_within_deadline(request)
+
+        # New SEO data invalidates every cached answer
+        if seo_agent.data_version != self._answer_cache_seo_version:
+            self.answer_cache.clear()
+            self._answer_cache_seo_version = seo_agent.data_version
+
+        key = answer_cache.make_key(request.query, request.propertyId, self._data_version(request))
+        if request.no_cache:
+            metrics.ANSWER_CACHE_REQUESTS.labels("bypass").inc()
+        else:
+            answer = self.answer_cache.get(key)
+            metrics.ANSWER_CACHE_REQUESTS.labels("hit" if answer is not None else "miss").inc()
+            if answer is not None:
+                request_context.emit("cache_hit", {})
+                return answer
+
+        with request_context.track_degradation() as degraded:
+            answer = await self._route_within_deadline(request)
+        if degraded:
+            logger.debug(f"Not caching degraded answer: {degraded}")
+        elif not request.no_store:
+            self.answer_cache.set(key, answer)
+        return answer
+
+    async def _route_within_deadline(self, request: QueryRequest):
+        """Route a request; if nothing at all was produced by the deadline, say so instead of failing."""
+        try:
+            return await request_context.within_deadline(
+                self._route_uncached(request), grace=DEADLINE_GRACE_SECONDS
+            )
+        except request_context.DeadlineExceeded:
+            request_context.mark_degraded("deadline reached before any answer")
+            return "The request deadline was reached before an answer could be produced."
+
+    def _data_version(self, request: QueryRequest) -> str:
+        """
+        Version of the data an answer depends on: the SEO fingerprint, plus today's
+        date in the property's timezone when GA4 may be queried (relative ranges
+        like "7daysAgo" resolve against it).
+        """
+        ga4_window = property_today(request.propertyId).isoformat() if request.propertyId else ""
+        return f"{seo_agent.data_version}:{ga4_window}"
+
+    async def _route_uncached(self, request: QueryRequest):
         """
         Routes the request to the appropriate agent(s).
         
         Tier 1/2: Simple routing based on propertyId presence
         Tier 3: LLM-based intent detection for multi-agent queries
         """
-        query = request.query.lower()
-        
-        # Tier 3: Detect if this might be a multi-agent query
-        intent = await self._detect_intent(request.query, request.propertyId)
-        logger.debug(f"Detected intent: {intent}")
-        
+        speculation = self._start_speculation(request)
+        try:
+            # Tier 3: Detect if this might be a multi-agent query (the planner may also return the full plan)
+            intent, plan = await self._classify_intent(request.query, request.propertyId)
+            logger.debug(f"Detected intent: {intent}")
+            request_context.emit("intent", {"intent": intent})
+            prefetch = self._resolve_speculation(speculation, intent)
+
+            return await self._dispatch(request, intent, plan, prefetch)
+        finally:
+            if speculation is not None:
+                speculation[0].cancel()
+
+    async def _dispatch(self, request: QueryRequest, intent: str, plan, prefetch):
+        """Hand a classified request to the matching agent(s)."""
         if intent == "BOTH":
             # Multi-agent fusion query
-            return await self._handle_multi_agent_query(request)
+            return await self._handle_multi_agent_query(request, plan, prefetch)
         elif intent == "ANALYTICS" and request.propertyId:
             # Pure Analytics query
-            return await analytics_agent.process_query(request.query, request.propertyId)
+            ga4_plans = plan.ga4_plans if isinstance(plan, QueryPlan) else None
+            return await analytics_agent.process_query(
+                request.query, request.propertyId, plans=ga4_plans, prefetch=prefetch
+            )
         elif intent == "SEO":
             # Pure SEO query
             return await seo_agent.process_query(request.query)
         else:
             # Fallback: Use simple routing
             if request.propertyId:
-                return await analytics_agent.process_query(request.query, request.propertyId)
+                return await analytics_agent.process_query(request.query, request.propertyId, prefetch=prefetch)
             else:
                 return await seo_agent.process_query(request.query)
 
+    async def stream_request(self, request: QueryRequest):
+        """
+        Route a request while yielding (event, data) progress tuples.
+
+        Stage events (intent, sub_queries, ga4_rows, seo_result, token) are
+        yielded as the pipeline produces them, followed by a final "answer"
+        or "error" event. Cancelling the generator cancels the request.
+        """
+        queue = asyncio.Queue()
+
+        async def run():
+            with request_context.event_stream(lambda event, data: queue.put_nowait((event, data))):
+                with request_context.track_degradation() as degraded:
+                    answer = await self.route_request(request)
+                return answer, bool(degraded)
+
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                next_event = asyncio.ensure_future(queue.get())
+                await asyncio.wait({next_event, task}, return_when=asyncio.FIRST_COMPLETED)
+                if not next_event.done():
+                    next_event.cancel()
+                    break
+                yield next_event.result()
+
+            while not queue.empty():
+                yield queue.get_nowait()
+
+            try:
+                answer, partial = task.result()
+                yield "answer", {"answer": answer, "partial": partial}
+            except Exception as e:
+                logger.error(f"Streaming request failed: {e}")
+                yield "error", {"detail": str(e)}
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def run_batch(self, requests: List[QueryRequest], max_concurrency: int = BATCH_MAX_CONCURRENCY):
+        """
+        Process a batch of requests, yielding (index, answer, error, partial) as items finish.
+
+        Identical requests (same normalized query, propertyId, cache options
+        and timeout) run once and their result is yielded for every index. Items are started grouped by
+        propertyId, so requests for one property overlap in time and share
+        in-flight plans and reports. At most max_concurrency requests run at once.
+        """
+        groups = {}
+        for index, request in enumerate(requests):
+            key = (
+                answer_cache.normalize_query(request.query), request.propertyId,
+                request.no_cache, request.no_store, request.timeout_seconds,
+            )
+            groups.setdefault(key, []).append(index)
+
+        property_order = {}
+        for key in groups:
+            property_order.setdefault(key[1], len(property_order))
+        ordered = sorted(groups.items(), key=lambda item: property_order[item[0][1]])
+
+        semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+        async def run(indexes):
+            async with semaphore:
+                # Batch items yield GA4 quota to interactive /query traffic
+                with request_context.track_degradation() as degraded, request_context.traffic(request_context.TRAFFIC_BATCH):
+                    try:
+                        answer = await self.route_request(requests[indexes[0]])
+                        return indexes, answer, None, bool(degraded)
+                    except Exception as e:
+                        logger.error(f"Batch item {indexes[0]} failed: {e}")
+                        return indexes, None, str(e), False
+
+        # Semaphore waiters are served in FIFO order, so tasks start in grouped order
+        tasks = [asyncio.create_task(run(indexes)) for _, indexes in ordered]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                indexes, answer, error, partial = await finished
+                for index in indexes:
+                    yield index, answer, error, partial
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _start_speculation(self, request: QueryRequest):
+        """
+        Start GA4 planning (and optionally the report) concurrently with intent classification.
+
+        Only used when enabled, a propertyId is present and the local fast path
+        cannot settle the intent on its own. The unified planner already returns
+        GA4 plans with the intent, so speculation is skipped while it is enabled.
+        Returns (task, calls_started) or None.
+        """
+        if not GA4_SPECULATION_ENABLED or UNIFIED_PLANNER_ENABLED or not request.propertyId:
+            return None
+        if self._local_intent(request.query, request.propertyId)[1] and not INTENT_SHADOW_MODE:
+            return None
+        calls = []
+        task = asyncio.create_task(analytics_agent.speculate(
+            request.query, request.propertyId, run_report=GA4_SPECULATIVE_REPORT, calls=calls
+        ))
+        return task, calls
+
+    def _resolve_speculation(self, speculation, intent: str):
+        """Return the speculative task if routing needs GA4, otherwise cancel it and count the waste."""
+        if speculation is None:
+            return None
+        task, calls = speculation
+        # With a propertyId, everything except a pure SEO intent ends up querying GA4
+        if intent != "SEO":
+            metrics.GA4_SPECULATIONS.labels("hit").inc()
+            return task
+        task.cancel()
+        metrics.GA4_SPECULATIONS.labels("miss").inc()
+        for call in calls:
+            metrics.GA4_SPECULATION_WASTED.labels(call).inc()
+        return None
+
+    def _local_intent(self, query: str, property_id: str = None) -> Tuple[str, bool]:
+        """Local classifier's intent and whether it is confident enough to skip the LLM."""
+        local_intent, confidence = self._local_classifier().classify(query, property_id)
+        logger.debug(f"Local intent: {local_intent} (confidence {confidence:.2f})")
+        return local_intent, INTENT_FAST_PATH_ENABLED and confidence >= INTENT_FAST_PATH_THRESHOLD
+
+    def _local_classifier(self) -> LocalIntentClassifier:
+        """Keyword classifier over GA4 field names and the loaded SEO columns (rebuilt when they change)."""
+        columns = frozenset(str(c) for df in seo_agent.dfs.values() for c in df.columns)
+        if self._intent_classifier is None or columns != self._intent_columns:
+            self._intent_classifier = LocalIntentClassifier(ALLOWED_METRICS | ALLOWED_DIMENSIONS, columns)
+            self._intent_columns = columns
+        return self._intent_classifier
+
+    async def _classify_intent(self, query: str, property_id: str = None) -> Tuple[str, object]:
+        """
+        Route obvious queries with the local classifier, everything else with the LLM.
+
+        Returns (intent, plan); plan is the unified planner's output when the
+        LLM path used it, PLANNER_FAILED when the planner was called and
+        failed, else None.
+        """
+        local_intent, confident = self._local_intent(query, property_id)
+
+        if confident and not INTENT_SHADOW_MODE:
+            metrics.INTENT_DECISIONS.labels("local").inc()
+            return local_intent, None
+
+        plan = await self._plan_query(query, property_id) if UNIFIED_PLANNER_ENABLED else None
+        intent = plan.intent if plan else await self._detect_intent(query, property_id)
+        metrics.INTENT_DECISIONS.labels("llm").inc()
+        if confident:
+            agreed = intent == local_intent
+            metrics.INTENT_SHADOW_COMPARISONS.labels("agree" if agreed else "disagree").inc()
+            if not agreed:
+                logger.info(f"Intent shadow mismatch: local={local_intent} llm={intent} for {query!r}")
+        if plan is None and UNIFIED_PLANNER_ENABLED:
+            return intent, PLANNER_FAILED
+        return intent, plan
+
+    async def _plan_query(self, query: str, property_id: str = None) -> Optional[QueryPlan]:
+        """
+        Unified planner: intent, sub-queries, output format and GA4 plan in one LLM call.
+
+        Returns None on failure so callers fall back to the separate intent,
+        decomposition and GA4 planning calls.
+        """
+        prompt = f"""You are the unified query planner for a data analytics system.
+
+Available agents:
+1. ANALYTICS - Handles Google Analytics 4 (GA4) data: users, sessions, page views, traffic sources, etc.
+2. SEO - Handles Screaming Frog SEO audit data: URLs, title tags, meta descriptions, indexability, HTTP status, etc.
+
+User Query: "{query}"
+Property ID Provided: {bool(property_id)}
+
+Return a JSON object with:
+- intent: ANALYTICS (only GA4 data), SEO (only SEO audit data) or BOTH (e.g., "top pages by views AND their title tags")
+- analytics_query: The specific question for the Analytics agent (the full query if intent is ANALYTICS, "" if SEO)
+- seo_query: The specific question for the SEO agent (the full query if intent is SEO, "" if ANALYTICS)
+- output_format: "json" if user explicitly requests JSON output, otherwise "natural_language"
+- limit: Number of results if specified in the query (default: 10)
+- seo_filter: true if the SEO part restricts which pages qualify (e.g. "non-indexable pages"), false if it only adds attributes (e.g. "their title tags")
+- ga4_plans: [] if intent is SEO; otherwise a list of GA4 Data API plans for analytics_query, each with:
+{GA4_PLAN_GUIDE}"""
+
+        try:
+            return await llm_client.chat_structured(
+                [{"role": "user", "content": prompt}],
+                response_model=QueryPlan,
+                model="gemini-2.5-flash",
+                priority=PRIORITY_HIGH,
+                stage=metrics.STAGE_PLAN
+            )
+        except Exception as e:
+            logger.error(f"Query planning error: {e}")
+            return None
+
     async def _detect_intent(self, query: str, property_id: str = None) -> str:
         """Use LLM with structured output to detect query intent for routing."""
         prompt = f"""You are an intent classifier for a data analytics system.
@@ -63,10 +366,12 @@ Classify the query into ONE of these categories:
 Return a JSON object with a single field "intent" containing one of the above values."""
         
         try:
-            result = llm_client.chat_structured(
+            result = await llm_client.chat_structured(
                 [{"role": "user", "content": prompt}],
                 response_model=IntentClassification,
-                model="gemini-2.5-flash"
+                model="gemini-2.5-flash",
+                priority=PRIORITY_HIGH,
+                stage=metrics.STAGE_INTENT
             )
             return result.intent
         except Exception as e:
@@ -87,13 +392,16 @@ Provide:
 - analytics_query: The specific question for the Analytics agent (focus on metrics like views, users, sessions)
 - seo_query: The specific question for the SEO agent (focus on URL metadata)
 - output_format: "json" if user explicitly requests JSON output, otherwise "natural_language"
-- limit: Number of results if specified in the query (default: 10)"""
+- limit: Number of results if specified in the query (default: 10)
+- seo_filter: true if the SEO part restricts which pages qualify (e.g. "non-indexable pages"), false if it only adds attributes (e.g. "their title tags")"""
         
         try:
-            result = llm_client.chat_structured(
+            result = await llm_client.chat_structured(
                 [{"role": "user", "content": prompt}],
                 response_model=DecomposedQuery,
-                model="gemini-2.5-flash"
+                model="gemini-2.5-flash",
+                priority=PRIORITY_HIGH,
+                stage=metrics.STAGE_DECOMPOSE
             )
             return result
         except Exception as e:
@@ -106,31 +414,37 @@ Provide:
                 limit=10
             )
 
-    def _normalize_url(self, url: str) -> str:
-        """Normalize URL/path for matching between GA4 and SEO data."""
-        if not url:
-            return ""
-        
-        # If it's a full URL, extract the path
-        if url.startswith("http"):
-            parsed = urlparse(url)
-            path = parsed.path
-        else:
-            path = url
-        
-        # Normalize: lowercase, remove trailing slash (except for root)
-        path = path.lower().rstrip("/")
-        if not path:
-            path = "/"
-        
-        return path
+    async def _run_branch(self, name: str, coro, timeout: float = BRANCH_TIMEOUT_SECONDS) -> AgentResult:
+        """Await one agent branch, turning a timeout or error into a note for fusion."""
+        # Never wait past the request deadline; fusion still needs what the other branch produced
+        left = request_context.remaining()
+        if left is not None:
+            timeout = max(min(timeout, left), 0)
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{name} branch timed out after {timeout:.0f}s")
+            request_context.mark_degraded(f"{name}: timed out")
+            return AgentResult(text=f"{name} error: timed out after {timeout:.0f} seconds")
+        except Exception as e:
+            request_context.mark_degraded(f"{name}: {e}")
+            return AgentResult(text=f"{name} error: {str(e)}")
 
-    async def _handle_multi_agent_query(self, request: QueryRequest) -> str:
+    async def _handle_multi_agent_query(self, request: QueryRequest, plan=None, prefetch=None) -> str:
         """Handle queries that require data from both Analytics and SEO agents."""
         
-        # Step 1: Decompose the query into agent-specific sub-queries
-        decomposition = await self._decompose_query(request.query)
+        # Step 1: Decompose the query into agent-specific sub-queries (one planner call covers
+        # decomposition and GA4 planning; the separate decomposition call is the fallback)
+        if plan is None and UNIFIED_PLANNER_ENABLED:
+            plan = await self._plan_query(request.query, request.propertyId)
+        if isinstance(plan, QueryPlan) and plan.analytics_query and plan.seo_query:
+            decomposition = DecomposedQuery(**plan.model_dump(include=set(DecomposedQuery.model_fields)))
+            ga4_plans = plan.ga4_plans
+        else:
+            decomposition = await self._decompose_query(request.query)
+            ga4_plans = None
         logger.debug(f"Query decomposition: {decomposition}")
+        request_context.emit("sub_queries", decomposition.model_dump())
         
         # Access Pydantic model attributes directly
         analytics_query = decomposition.analytics_query
@@ -138,24 +452,62 @@ Provide:
         output_format = decomposition.output_format
         limit = decomposition.limit
         
-        # Step 2: Get Analytics data if propertyId is available
-        analytics_data = None
-        if request.propertyId:
-            try:
-                analytics_data = await analytics_agent.process_query(analytics_query, request.propertyId)
-            except Exception as e:
-                analytics_data = f"Analytics error: {str(e)}"
-        
-        # Step 3: Get SEO data
-        try:
-            seo_data = await seo_agent.process_query(seo_query)
-        except Exception as e:
-            seo_data = f"SEO error: {str(e)}"
+        # Steps 2-3: Run the Analytics (if propertyId is available) and SEO branches concurrently.
+        # Agents return their tables; the GA4 summary is skipped since fusion narrates the joined rows.
+        async def no_analytics():
+            return None
+
+        with request_context.intermediate():
+            analytics_result, seo_result = await asyncio.gather(
+                self._run_branch(
+                    "Analytics", analytics_agent.run_query(
+                        analytics_query, request.propertyId, summarize=False, plans=ga4_plans, prefetch=prefetch
+                    )
+                ) if request.propertyId else no_analytics(),
+                self._run_branch("SEO", seo_agent.run_query(seo_query, tabular=True)),
+            )
+        analytics_data = analytics_result.text if analytics_result else None
+        seo_data = seo_result.text
+
+        # Step 4: Join the tables locally on normalized URL path
+        table = fusion.join_results(
+            analytics_result.frame if analytics_result else None, seo_result.frame, limit,
+            seo_filter=decomposition.seo_filter,
+        )
+        if table is not None and output_format == "json":
+            return fusion.to_records_json(table)
+
+        # Step 5: Have the LLM write the answer
+        if table is not None:
+            notes = [r.text for r in (analytics_result, seo_result) if r is not None and r.frame is None]
+            if analytics_result is None:
+                notes.append("No analytics data available (no propertyId provided)")
+            notes_text = "\n        ".join(notes) if notes else "None"
+            data_section = f"""Matched Data (GA4 rows joined with SEO audit rows on URL path, top {len(table)} rows):
+        {table.to_string(index=False)}
+
+        Unavailable or non-tabular results:
+        {notes_text}"""
+            instructions = f"""Instructions:
+        1. The rows above are already matched between the two sources; do not re-match them
+        2. Provide a comprehensive answer to the query using these rows (at most {limit} items)
+        3. If data from one source is missing, explain what was available"""
+            json_instruction = ""
+        else:
+            data_section = f"""Analytics Data (GA4 - page views, users, sessions):
+        {analytics_data if analytics_data else "No analytics data available"}
         
-        # Step 4: Fuse the results using LLM
-        json_instruction = ""
-        if output_format == "json":
-            json_instruction = """
+        SEO Audit Data (URLs, title tags, meta descriptions, indexability):
+        {seo_data[:4000] if seo_data else "No SEO data available"}"""
+            instructions = f"""Instructions:
+        1. Match pages between the two data sources by comparing paths/URLs
+        2. GA4 uses 'pagePath' (e.g., /pricing), SEO uses full URLs (e.g., https://example.com/pricing)
+        3. Provide a comprehensive answer combining insights from both sources
+        4. Limit results to {limit} items unless otherwise specified
+        5. If data from one source is missing, explain what was available"""
+            json_instruction = ""
+            if output_format == "json":
+                json_instruction = """
             IMPORTANT: The user explicitly requested JSON output.
             Return the answer as a valid JSON array of objects. Each object should contain the relevant fields from both data sources.
             Example format:
@@ -164,44 +516,53 @@ Provide:
                 ...
             ]
             """
-        
+
+        streaming = request_context.stream_tokens()
+        if streaming:
+            output_structure = """REQUIRED OUTPUT STRUCTURE:
+        Respond with the answer itself (or the JSON array if requested), with no wrapper object."""
+        else:
+            output_structure = """REQUIRED OUTPUT STRUCTURE:
+        Return a JSON object with exactly two fields:
+        - "answer": The comprehensive answer string (or JSON string if requested).
+        - "references": A list of source URLs used."""
+
         fusion_prompt = f"""
         You are a data analyst combining results from multiple sources.
         
         Original User Query: "{request.query}"
         Requested Result Limit: {limit}
         
-        Analytics Data (GA4 - page views, users, sessions):
-        {analytics_data if analytics_data else "No analytics data available"}
-        
-        SEO Audit Data (URLs, title tags, meta descriptions, indexability):
-        {seo_data[:4000] if seo_data else "No SEO data available"}
+        {data_section}
         
-        Instructions:
-        1. Match pages between the two data sources by comparing paths/URLs
-        2. GA4 uses 'pagePath' (e.g., /pricing), SEO uses full URLs (e.g., https://example.com/pricing)
-        3. Provide a comprehensive answer combining insights from both sources
-        4. Limit results to {limit} items unless otherwise specified
-        5. If data from one source is missing, explain what was available
+        {instructions}
         
-        REQUIRED OUTPUT STRUCTURE:
-        Return a JSON object with exactly two fields:
-        - "answer": The comprehensive answer string (or JSON string if requested).
-        - "references": A list of source URLs used.
+        {output_structure}
         
         {json_instruction}
         """
         
         try:
-            fused_response = llm_client.chat_structured(
+            if streaming:
+                return await request_context.relay_tokens(llm_client.chat_stream(
+                    [{"role": "user", "content": fusion_prompt}],
+                    model="gemini-2.5-flash",
+                    priority=PRIORITY_LOW,
+                    stage=metrics.STAGE_FUSION
+                ))
+            fused_response = await llm_client.chat_structured(
                 [{"role": "user", "content": fusion_prompt}],
                 response_model=MultiAgentResponse,
-                model="gemini-2.5-flash"
+                model="gemini-2.5-flash",
+                priority=PRIORITY_LOW,
+                stage=metrics.STAGE_FUSION
             )
             return fused_response.answer
         except Exception as e:
             # Fallback: Return whatever data we have
+            request_context.mark_degraded("fusion failed")
+            if table is not None:
+                return f"Multi-agent query partially completed.\n\n{table.to_string(index=False)}"
             return f"Multi-agent query partially completed.\n\nAnalytics: {analytics_data}\n\nSEO: {seo_data}"
 
 orchestrator = Orchestrator()
-
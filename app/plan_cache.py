@@ -0,0 +1,108 @@
+"""
+Memoized planning outputs: validated GA4 plans and compiled SEO analysis code.
+
+Keys are the normalized question text (plus, for SEO code, the fingerprint
+of the loaded sheet schema, so code is regenerated when columns change). A
+hit skips the planning LLM call, and for SEO code also compile(). Entries
+can be pinned from PLAN_CACHE_FILE at startup; pinned entries are never
+evicted. Questions listed there without a plan or code are planned once in
+the background to warm the cache.
+
+File format:
+{
+  "ga4": [{"query": "...", "plans": [{GA4QueryPlan}, ...]}, {"query": "..."}],
+  "seo": [{"query": "...", "code": "result = ...", "tabular": false}, {"query": "..."}]
+}
+"""
+
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app import metrics
+from app.answer_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "1000"))
+PLAN_CACHE_FILE = os.getenv("PLAN_CACHE_FILE", "")
+
+
+def ga4_key(query: str) -> str:
+    return f"ga4:{normalize_query(query)}"
+
+
+def seo_key(query: str, schema_version: str, tabular: bool) -> str:
+    return f"seo:{schema_version}:{int(tabular)}:{normalize_query(query)}"
+
+
+class PlanCache:
+    def __init__(self, max_entries: int = PLAN_CACHE_MAX_ENTRIES, enabled: bool = PLAN_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()  # key -> value (LRU order)
+        self._pinned = {}  # key -> value, never evicted
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        kind = key.split(":", 1)[0]
+        value = self._pinned.get(key)
+        if value is None:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is None:
+            self.misses += 1
+            metrics.PLAN_CACHE_REQUESTS.labels(kind=kind, result="miss").inc()
+            return None
+        self.hits += 1
+        metrics.PLAN_CACHE_REQUESTS.labels(kind=kind, result="hit").inc()
+        return value
+
+    def set(self, key: str, value: Any, pinned: bool = False):
+        if not self.enabled:
+            return
+        if pinned:
+            self._pinned[key] = value
+            self._entries.pop(key, None)
+            return
+        if key in self._pinned:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop unpinned entries."""
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "pinned": len(self._pinned),
+        }
+
+
+def load_cache_file(path: str = PLAN_CACHE_FILE) -> dict:
+    """Read the pin/warm file; an empty dict when unset or unreadable."""
+    if not path:
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read plan cache file '{path}': {e}")
+        return {}
+
+
+plan_cache = PlanCache()
@@ -0,0 +1,214 @@
+"""
+Request-scoped state shared by the orchestrator, agents and LLM client.
+
+Values live in context variables, so they follow a request through awaits
+and into tasks it spawns without threading extra arguments through every
+call.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional
+
+# Callback receiving (event, data) for progressive /query/stream responses
+_event_sink: ContextVar[Optional[Callable[[str, Any], None]]] = ContextVar("event_sink", default=None)
+# False while producing intermediate results (e.g. an agent's answer that feeds fusion)
+_final_answer: ContextVar[bool] = ContextVar("final_answer", default=True)
+# Reasons the current answer is degraded (agent errors, fallbacks); shared by tasks the request starts
+_degraded: ContextVar[Optional[list]] = ContextVar("degraded", default=None)
+# time.monotonic() by which the current request must be answered
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+TRAFFIC_INTERACTIVE = "interactive"
+TRAFFIC_BATCH = "batch"
+# Who is waiting on the request; interactive traffic is served first where capacity is scarce
+_traffic_class: ContextVar[Optional[str]] = ContextVar("traffic_class", default=None)
+
+
+class Budget:
+    """
+    Deadline and traffic class of a call shared by several requests (see SingleFlight).
+
+    Each caller joining the call widens it: the latest deadline (none if any
+    caller has none) and the most urgent traffic class. Work running for the
+    shared call reads it live through remaining() and traffic_class().
+    """
+
+    def __init__(self, deadline_at: Optional[float], traffic_name: str):
+        self.deadline = deadline_at
+        self.traffic = traffic_name
+
+    @classmethod
+    def current(cls) -> "Budget":
+        """The calling request's budget."""
+        return cls(_deadline_at(), traffic_class())
+
+    def join(self, other: "Budget"):
+        if self.deadline is not None:
+            self.deadline = None if other.deadline is None else max(self.deadline, other.deadline)
+        if other.traffic == TRAFFIC_INTERACTIVE:
+            self.traffic = TRAFFIC_INTERACTIVE
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+
+# Budget of the shared call the current task executes on behalf of its waiters
+_shared_budget: ContextVar[Optional[Budget]] = ContextVar("shared_budget", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the current request's time budget is used up."""
+
+
+@contextmanager
+def event_stream(sink: Callable[[str, Any], None]):
+    """Route emit() calls made within the block (and tasks it starts) to sink."""
+    token = _event_sink.set(sink)
+    try:
+        yield
+    finally:
+        _event_sink.reset(token)
+
+
+@contextmanager
+def intermediate():
+    """Mark answers produced within the block as intermediate, so their tokens aren't streamed."""
+    token = _final_answer.set(False)
+    try:
+        yield
+    finally:
+        _final_answer.reset(token)
+
+
+@contextmanager
+def track_degradation():
+    """
+    Collect mark_degraded() reasons from within the block (and tasks it starts); yields the list.
+
+    Nested blocks share the outer block's list, so every level sees all reasons.
+    """
+    reasons = _degraded.get()
+    if reasons is not None:
+        yield reasons
+        return
+    reasons = []
+    token = _degraded.set(reasons)
+    try:
+        yield reasons
+    finally:
+        _degraded.reset(token)
+
+
+def mark_degraded(reason: str):
+    """Record that the answer being produced is incomplete or a fallback (so it isn't cached)."""
+    reasons = _degraded.get()
+    if reasons is not None:
+        reasons.append(reason)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]):
+    """Give the block (and tasks it starts) a time budget; an enclosing, earlier deadline still wins."""
+    if not seconds or seconds <= 0:
+        yield
+        return
+    at = time.monotonic() + seconds
+    current = _deadline_at()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def share_budget(budget: Budget):
+    """Run the current context (a shared call's own context) under budget; see SingleFlight."""
+    _shared_budget.set(budget)
+
+
+def _deadline_at() -> Optional[float]:
+    at = _deadline.get()
+    budget = _shared_budget.get()
+    if budget is None or budget.deadline is None:
+        return at
+    return budget.deadline if at is None else min(at, budget.deadline)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline (may be negative), or None without one."""
+    at = _deadline_at()
+    return None if at is None else at - time.monotonic()
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the current request's deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("request deadline exceeded")
+
+
+async def within_deadline(awaitable: Awaitable, grace: float = 0.0):
+    """Await awaitable, cancelling it with DeadlineExceeded once the deadline (plus grace) passes."""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    left += grace
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        elif isinstance(awaitable, asyncio.Future):
+            awaitable.cancel()
+        raise DeadlineExceeded("request deadline exceeded")
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError as e:
+        if isinstance(e, DeadlineExceeded):
+            raise
+        raise DeadlineExceeded("request deadline exceeded") from e
+
+
+@contextmanager
+def traffic(name: str):
+    """Tag work within the block (and tasks it starts) with a traffic class."""
+    token = _traffic_class.set(name)
+    try:
+        yield
+    finally:
+        _traffic_class.reset(token)
+
+
+def traffic_class() -> str:
+    name = _traffic_class.get()
+    if name is not None:
+        return name
+    budget = _shared_budget.get()
+    return budget.traffic if budget is not None else TRAFFIC_INTERACTIVE
+
+
+def streaming() -> bool:
+    """True when the current request is being streamed to the client."""
+    return _event_sink.get() is not None
+
+
+def stream_tokens() -> bool:
+    """True when the answer being produced should be streamed token by token."""
+    return streaming() and _final_answer.get()
+
+
+def emit(event: str, data: Any = None):
+    """Publish a progress event for the current request (no-op when not streaming)."""
+    sink = _event_sink.get()
+    if sink is not None:
+        sink(event, data)
+
+
+async def relay_tokens(deltas) -> str:
+    """Emit each text delta from an async iterator as a token event; return the full text."""
+    chunks = []
+    async for delta in deltas:
+        chunks.append(delta)
+        emit("token", {"text": delta})
+    return "".join(chunks)
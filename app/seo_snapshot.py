@@ -0,0 +1,171 @@
+"""
+On-disk columnar snapshot of the SEO DataFrames.
+
+Each sheet is stored as an uncompressed Arrow IPC file, so a snapshot can
+be memory-mapped and turned into ArrowDtype-backed DataFrames without
+copying: startup does not wait for Google Sheets, and several workers on
+one host share the same page cache.
+
+Layout under SEO_SNAPSHOT_DIR:
+
+    manifest.json          {"format", "data_version", "schema_version", "generation",
+                            "files": {key: file}, "spreadsheets": {name: {"id", "revision", "sheets"}}}
+    gen-<time_ns>-<suffix>/<n>.arrow
+                           one file per sheet
+    .lock                  writer lock (flock)
+
+A snapshot is written into a fresh generation directory and published by
+atomically replacing manifest.json, so readers only ever see complete
+snapshots. Writers on the host take turns under lock() (readers hold it
+shared while mapping), and publishing removes only generations older than
+the published one; processes that still map them keep their pages until
+they unmap.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+SEO_SNAPSHOT_ENABLED = os.getenv("SEO_SNAPSHOT_ENABLED", "true").lower() == "true"
+SEO_SNAPSHOT_DIR = os.getenv("SEO_SNAPSHOT_DIR", "seo_snapshot")
+
+SNAPSHOT_FORMAT = 1
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+
+
+def _column_array(column: pd.Series) -> pa.Array:
+    """
+    Arrow array for one column.
+
+    Sheets columns can mix numbers with blank cells (""); blanks become
+    nulls. Columns that are still mixed (numbers and text) are stored as text.
+    """
+    try:
+        return pa.array(column, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+    try:
+        return pa.array(column.replace("", None), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array(column.astype(str), from_pandas=True)
+
+
+def to_table(df: pd.DataFrame) -> pa.Table:
+    return pa.Table.from_arrays(
+        [_column_array(df.iloc[:, i]) for i in range(df.shape[1])],
+        names=[str(c) for c in df.columns],
+    )
+
+
+def _read_table(path: str) -> pd.DataFrame:
+    # Zero-copy: the DataFrame's buffers point into the mapped file
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def _write_table(path: str, table: pa.Table):
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def write_snapshot(dfs: dict, spreadsheets: dict, directory: str = SEO_SNAPSHOT_DIR) -> dict:
+    """
+    Write dfs ({key: DataFrame}) as a new, not yet published snapshot generation.
+
+    spreadsheets maps each spreadsheet name to {"id", "revision", "sheets": [keys]}.
+    Nothing is visible to readers until the returned manifest is passed to
+    publish() (the caller first adds the data and schema versions).
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Names order by creation time (zero-padded), so publish() can tell older generations apart
+    generation = tempfile.mkdtemp(prefix=f"gen-{time.time_ns():020d}-", dir=directory)
+    files = {}
+    for n, key in enumerate(sorted(dfs)):
+        files[key] = f"{n}.arrow"
+        _write_table(os.path.join(generation, files[key]), to_table(dfs[key]))
+    return {
+        "format": SNAPSHOT_FORMAT,
+        "generation": os.path.basename(generation),
+        "files": files,
+        "spreadsheets": spreadsheets,
+    }
+
+
+def map_snapshot(manifest: dict, directory: str = SEO_SNAPSHOT_DIR) -> dict:
+    """Memory-map every sheet listed in the manifest as {key: DataFrame}."""
+    generation = os.path.join(directory, manifest["generation"])
+    return {key: _read_table(os.path.join(generation, name)) for key, name in manifest["files"].items()}
+
+
+@contextmanager
+def lock(directory: str = SEO_SNAPSHOT_DIR, shared: bool = False):
+    """
+    Hold the directory's lock, so processes write and publish snapshots one at a time.
+
+    Readers hold it shared while mapping, so their generation is not removed under them.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _generation_time(name: str) -> int:
+    """Creation time encoded in a generation name (-1 for names without one)."""
+    try:
+        return int(name.split("-")[1])
+    except (IndexError, ValueError):
+        return -1
+
+
+def publish(manifest: dict, directory: str = SEO_SNAPSHOT_DIR):
+    """
+    Atomically make manifest the current snapshot and drop older generations.
+
+    Call under lock(): generations written meanwhile by other processes are
+    newer and kept.
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix="manifest-", suffix=".tmp", dir=directory)
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_FILE))
+
+    published = _generation_time(manifest["generation"])
+    for entry in os.listdir(directory):
+        path = os.path.join(directory, entry)
+        if entry.startswith("gen-") and _generation_time(entry) < published and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_snapshot(directory: str = SEO_SNAPSHOT_DIR) -> Optional[Tuple[dict, dict]]:
+    """(dfs, manifest) of the current snapshot, or None when there is no usable one."""
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with lock(directory, shared=True):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("format") != SNAPSHOT_FORMAT:
+                return None
+            return map_snapshot(manifest, directory), manifest
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable SEO snapshot in '{directory}': {e}")
+        return None
@@ -0,0 +1,82 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+Concurrent callers that ask for the same key share one underlying task
+instead of each issuing their own request. The key is forgotten as soon as
+the task completes, so nothing is cached past completion; results only
+outlive the call if a cache layer stores them.
+"""
+
+import asyncio
+import contextvars
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+from app import request_context
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ("task", "budget", "waiters")
+
+    def __init__(self, task: asyncio.Task, budget: request_context.Budget):
+        self.task = task
+        self.budget = budget
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[request_context.Budget], Awaitable[Any]]) -> Any:
+        """
+        Run fn(budget) for key, or join the call already in flight for it.
+
+        Results and exceptions are delivered to every waiter. A waiter being
+        cancelled does not cancel the shared call unless it was the last one
+        waiting on it.
+
+        The shared call runs in its own context, so it does not inherit the
+        first caller's event sink or degradation list. Its deadline and
+        traffic class come from budget, which every joining caller widens to
+        the most generous deadline and most urgent class; request_context
+        reads inside the call see it. Each waiter still bounds its own wait
+        (e.g. with request_context.within_deadline).
+        """
+        budget = request_context.Budget.current()
+        call = self._calls.get(key)
+        if call is None:
+            context = contextvars.Context()
+            context.run(request_context.share_budget, budget)
+            call = _Call(asyncio.get_running_loop().create_task(fn(budget), context=context), budget)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _task: self._forget(key, call))
+            self.executions += 1
+        else:
+            call.budget.join(budget)
+            self.coalesced += 1
+            logger.debug(f"{self.name}: joined in-flight call ({call.waiters} already waiting)")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+        }
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -1,4 +1,7 @@
+import asyncio
+import json
 import logging
+import os
 
 # Configure logging
 logging.basicConfig(
@@ -11,22 +14,113 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-from fastapi import FastAPI, HTTPException
-from app.models import QueryRequest, QueryResponse
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from app.models import QueryRequest, QueryResponse, BatchQueryRequest, BatchQueryResponse, BatchItemResult
 from app.orchestrator import orchestrator
 from app.llm.client import llm_client
+from app.agents.analytics import analytics_agent
+from app.agents.seo import seo_agent
+from app.plan_cache import load_cache_file
+from app import metrics, request_context
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared GA4 client (credentials + gRPC channel) once for all requests
+    await analytics_agent.start()
+    # Pin known plans / analysis code and warm the plan cache for listed questions in the background
+    warm = load_cache_file()
+    warming = asyncio.gather(
+        analytics_agent.warm_plans(warm.get("ga4", [])),
+        seo_agent.warm_code(warm.get("seo", [])),
+    ) if warm else None
+    yield
+    if warming is not None:
+        warming.cancel()
+    # Release pooled keep-alive connections to the LiteLLM proxy and the GA4 channel
+    await llm_client.aclose()
+    await analytics_agent.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+def apply_headers(request: QueryRequest, cache_control: Optional[str], request_timeout: Optional[float]) -> QueryRequest:
+    """Map Cache-Control no-cache / no-store and X-Request-Timeout headers onto the request fields."""
+    directives = {d.strip().lower() for d in (cache_control or "").split(",")}
+    update = {}
+    if "no-cache" in directives:
+        update["no_cache"] = True
+    if "no-store" in directives:
+        update["no_store"] = True
+    if request_timeout and request.timeout_seconds is None:
+        update["timeout_seconds"] = request_timeout
+    return request.model_copy(update=update) if update else request
 
 @app.post("/query", response_model=QueryResponse)
-async def query_endpoint(request: QueryRequest):
+async def query_endpoint(
+    request: QueryRequest,
+    cache_control: Optional[str] = Header(default=None),
+    x_request_timeout: Optional[float] = Header(default=None, gt=0),
+):
+    request = apply_headers(request, cache_control, x_request_timeout)
     try:
         # For now, just echo through orchestrator
-        answer = await orchestrator.route_request(request)
-        return QueryResponse(answer=answer)
+        with request_context.track_degradation() as degraded:
+            answer = await orchestrator.route_request(request)
+        return QueryResponse(answer=answer, partial=bool(degraded))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query/stream")
+async def query_stream_endpoint(
+    request: QueryRequest,
+    cache_control: Optional[str] = Header(default=None),
+    x_request_timeout: Optional[float] = Header(default=None, gt=0),
+):
+    """Server-sent events: stage events as they complete, then answer tokens and the final answer."""
+    request = apply_headers(request, cache_control, x_request_timeout)
+    async def event_source():
+        async for event, data in orchestrator.stream_request(request):
+            yield f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_batch_endpoint(
+    batch: BatchQueryRequest,
+    cache_control: Optional[str] = Header(default=None),
+    x_request_timeout: Optional[float] = Header(default=None, gt=0),
+):
+    """Answer many queries at once; results are in request order, or NDJSON in completion order when streaming."""
+    if len(batch.queries) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {BATCH_MAX_ITEMS} queries")
+    batch.queries = [apply_headers(q, cache_control, x_request_timeout) for q in batch.queries]
+
+    if batch.stream:
+        async def lines():
+            async for index, answer, error, partial in orchestrator.run_batch(batch.queries):
+                yield BatchItemResult(index=index, answer=answer, error=error, partial=partial).model_dump_json() + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    results = [None] * len(batch.queries)
+    async for index, answer, error, partial in orchestrator.run_batch(batch.queries):
+        results[index] = BatchItemResult(index=index, answer=answer, error=error, partial=partial)
+    return BatchQueryResponse(results=results)
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    # Rendered on the event loop: collectors read client/limiter state that only the loop mutates
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
@@ -0,0 +1,48 @@
+import requests
+import json
+
+def run_batch(label, payload):
+    url = "http://localhost:8080/query/batch"
+    
+    print(f"\n--- {label} ---")
+    print(f"Queries: {len(payload['queries'])}")
+    
+    try:
+        if payload.get("stream"):
+            with requests.post(url, json=payload, stream=True) as response:
+                print(f"Status Code: {response.status_code}")
+                if response.status_code != 200:
+                    print(f"Error: {response.text}")
+                    return
+                for line in response.iter_lines(decode_unicode=True):
+                    if line:
+                        print(json.dumps(json.loads(line))[:500])
+            return
+
+        response = requests.post(url, json=payload)
+        print(f"Status Code: {response.status_code}")
+        if response.status_code == 200:
+            print("Response Body:")
+            print(json.dumps(response.json(), indent=2))
+        else:
+            print(f"Error: {response.text}")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+def test_batch():
+    # Common property ID
+    property_id = "516747840"
+
+    queries = [
+        {"propertyId": property_id, "query": "How many active users did we have in the last 7 days?"},
+        {"propertyId": property_id, "query": "What are the top 5 pages by page views in the last 30 days?"},
+        {"query": "Which URLs do not use HTTPS?"},
+        # Duplicate of the first query: answered once, returned for both indexes
+        {"propertyId": property_id, "query": "How many active users did we have in the last 7 days?"},
+    ]
+
+    run_batch("Batch (ordered JSON response)", {"queries": queries})
+    run_batch("Batch (NDJSON stream)", {"queries": queries, "stream": True})
+
+if __name__ == "__main__":
+    test_batch()
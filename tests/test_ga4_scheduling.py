@@ -0,0 +1,81 @@
+import asyncio
+import os
+
+os.environ.setdefault("LITELLM_API_KEY", "test")
+
+from google.analytics.data_v1beta.types import PropertyQuota, QuotaStatus, RunReportRequest, RunReportResponse
+
+from app import request_context
+from app.agents.analytics import AnalyticsAgent
+from app.ga4_quota import GA4QuotaScheduler
+
+
+class FakeGA4Client:
+    """Records the timeout of each run_report call."""
+
+    def __init__(self):
+        self.timeouts = []
+
+    async def run_report(self, request, retry=None, timeout=None):
+        self.timeouts.append(timeout)
+        return RunReportResponse()
+
+
+def test_coalesced_report_keeps_traffic_class_and_deadline():
+    agent = AnalyticsAgent()
+    agent.report_cache = None
+    agent._client = FakeGA4Client()
+    seen = []
+    acquire = agent.quota.acquire
+
+    async def spy(property_id, traffic):
+        seen.append(traffic)
+        await acquire(property_id, traffic)
+
+    agent.quota.acquire = spy
+    request = RunReportRequest(property="properties/123")
+
+    async def main():
+        with request_context.traffic(request_context.TRAFFIC_BATCH), request_context.deadline(2):
+            await agent._run_report(request)
+
+    asyncio.run(main())
+    assert seen == [request_context.TRAFFIC_BATCH]
+    assert agent._client.timeouts and agent._client.timeouts[0] <= 2
+
+
+def test_interactive_calls_are_served_before_batch_calls():
+    scheduler = GA4QuotaScheduler(max_concurrent=1)
+    order = []
+
+    async def call(traffic):
+        await scheduler.acquire("123", traffic)
+        order.append(traffic)
+        scheduler.release("123")
+
+    async def main():
+        await scheduler.acquire("123", request_context.TRAFFIC_INTERACTIVE)
+        batch = asyncio.create_task(call(request_context.TRAFFIC_BATCH))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(call(request_context.TRAFFIC_INTERACTIVE))
+        await asyncio.sleep(0)
+        scheduler.release("123")
+        await asyncio.gather(batch, interactive)
+
+    asyncio.run(main())
+    assert order == [request_context.TRAFFIC_INTERACTIVE, request_context.TRAFFIC_BATCH]
+
+
+def test_batch_calls_wait_below_the_reserve():
+    scheduler = GA4QuotaScheduler(batch_reserve_tokens=100)
+    scheduler.record("123", PropertyQuota(tokens_per_hour=QuotaStatus(remaining=50)))
+
+    async def main():
+        await asyncio.wait_for(scheduler.acquire("123", request_context.TRAFFIC_INTERACTIVE), 1)
+        batch = asyncio.create_task(scheduler.acquire("123", request_context.TRAFFIC_BATCH))
+        await asyncio.sleep(0.05)
+        held = not batch.done()
+        batch.cancel()
+        return held
+
+    assert asyncio.run(main())
@@ -0,0 +1,57 @@
+import requests
+import json
+
+def run_stream_query(label, payload):
+    url = "http://localhost:8080/query/stream"
+    
+    print(f"\n--- {label} ---")
+    print(f"Query: {payload['query']}")
+    
+    try:
+        with requests.post(url, json=payload, stream=True) as response:
+            print(f"Status Code: {response.status_code}")
+            if response.status_code != 200:
+                print(f"Error: {response.text}")
+                return
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data = json.loads(line[len("data: "):])
+                    if event == "token":
+                        print(data["text"], end="", flush=True)
+                    else:
+                        print(f"\n[{event}] {json.dumps(data)[:500]}")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+def test_stream():
+    # Common property ID
+    property_id = "516747840"
+
+    test_cases = [
+        {
+            "label": "Streamed Analytics Answer",
+            "propertyId": property_id,
+            "query": "Give me a daily breakdown of users for the last 7 days"
+        },
+        {
+            "label": "Streamed SEO Answer",
+            "query": "Which URLs do not use HTTPS?"
+        },
+        {
+            "label": "Streamed Multi-Agent Fusion",
+            "propertyId": property_id,
+            "query": "What are the top 10 pages by page views in the last 30 days, and what are their corresponding title tags?"
+        }
+    ]
+
+    for case in test_cases:
+        payload = {"query": case["query"]}
+        if "propertyId" in case:
+            payload["propertyId"] = case["propertyId"]
+        run_stream_query(case["label"], payload)
+
+if __name__ == "__main__":
+    test_stream()